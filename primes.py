@@ -18,6 +18,7 @@ logger = logging.getLogger(__name__)
 
 from sparkl_services import (
     ws,
+    batch,
     s_op_rr,
     register_eventcallback
 )
@@ -25,7 +26,7 @@ from sparkl_services import (
 
 def handle_request(opname, fields):
     logger.debug(opname)
-    logger.debug(str(fields))
+    logger.debug('%s', fields)
     if opname == "FirstDivisor":
         return handle_fd()
     elif opname == "Test":
@@ -82,7 +83,8 @@ if __name__ == '__main__':
     encoding = 'json'
 
     url_ws = \
-        host+":"+port+"/"+url_stub+"_ws/connect?pending="+processid+"&encoding="+encoding
+        host+":"+port+"/"+url_stub+"_ws/connect?pending="+processid + \
+        "&encoding="+encoding+batch.urlparams()
 
     logger.debug(url_ws)
 
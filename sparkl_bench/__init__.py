@@ -0,0 +1,10 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+In-process benchmarks of the message handling path. Synthetic open and
+data events are driven through sparkl_services.handle_msg for container
+callback, python, eclipse-clp and ansible services, the latter two against
+stub executables, reporting throughput, per-phase latency and allocations.
+
+Run as:  python -m sparkl_bench --help
+"""
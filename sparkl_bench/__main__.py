@@ -0,0 +1,239 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Runs the message handling benchmarks, each service kind in three passes:
+throughput, with metrics off; per-phase latency, with metrics on; and
+allocations, with tracemalloc on.
+"""
+
+import argparse
+import gc
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+import sparkl_services as ss
+from sparkl_services import metrics
+from sparkl_bench import events, stubs
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+s_kinds = ['callback', 'python', 'eclipse', 'ansible']
+
+# phases, in the order they are reported
+s_phases = [
+    metrics.s_decode,
+    metrics.s_lookup,
+    metrics.s_fields_in,
+    metrics.s_execute,
+    metrics.s_fields_out,
+    metrics.s_encode]
+
+
+def service(kind, instanceid, args):
+    """
+    Gives the open event for a service of the given kind
+    """
+
+    if kind == 'callback':
+        ss.register_eventcallback(ss.s_op_rr, events.callback)
+        return events.openevent(
+            instanceid, ss.s_type_containerservice, args.ops, args.fields,
+            args.props, args.size)
+
+    language, script = {
+        'python': ('python', events.pythonscript),
+        'eclipse': ('eclipse-clp', events.eclipsescript),
+        'ansible': ('ansible', events.ansiblescript)}[kind]
+
+    return events.openevent(
+        instanceid, ss.s_type_scriptservice, args.ops, args.fields,
+        args.props, args.size, language, script(args.ops))
+
+
+def drive(messages, envpath):
+    for message in messages:
+        reply = ss.handle_msg(message, envpath)
+        if reply is not None:
+            ss.encode_msg(reply)
+
+
+def percentile(histogram, bounds, fraction):
+    # upper bound of the bucket holding the given fraction of observations
+    target = histogram['count'] * fraction
+    seen = 0
+    for index, count in enumerate(histogram['buckets']):
+        seen += count
+        if seen >= target:
+            return bounds[index] if index < len(bounds) else float('inf')
+    return float('inf')
+
+
+def phases(snapshot):
+    """
+    Aggregates the histograms of a metrics snapshot by phase, over instances
+    and ops
+    """
+
+    bounds = snapshot['bounds']
+    merged = {}
+    for histogram in snapshot['histograms']:
+        phase = merged.get(histogram['phase'])
+        if phase is None:
+            phase = merged[histogram['phase']] = {
+                'count': 0, 'sum': 0.0, 'max': 0.0,
+                'buckets': [0] * len(histogram['buckets'])}
+        phase['count'] += histogram['count']
+        phase['sum'] += histogram['sum']
+        phase['max'] = max(phase['max'], histogram['max'])
+        phase['buckets'] = [
+            a + b for a, b in zip(phase['buckets'], histogram['buckets'])]
+
+    return dict(
+        (name,
+         {'count': phase['count'],
+          'mean': phase['sum'] / phase['count'] if phase['count'] else 0.0,
+          'p50': percentile(phase, bounds, 0.5),
+          'p99': percentile(phase, bounds, 0.99),
+          'max': phase['max']})
+        for name, phase in merged.items())
+
+
+def bench(kind, args, envpath):
+    """
+    Benchmarks a service kind
+
+    :rtype: dict
+    :return: throughput, phases and allocations
+    """
+
+    instanceid = 'I-' + kind
+    ss.handle_msg(json.dumps(service(kind, instanceid, args)), envpath)
+
+    messages = [
+        json.dumps(event) for event in events.dataevents(
+            instanceid, args.ops, args.fields, args.size, args.messages)]
+
+    # warm caches, pools and scratch environments
+    drive(messages[:args.warmup], envpath)
+
+    gc.collect()
+    started = time.time()
+    drive(messages, envpath)
+    elapsed = time.time() - started
+
+    metrics.enabled = True
+    drive(messages, envpath)
+    metrics.enabled = False
+    snapshot = metrics.snapshot()
+    metrics.histograms.clear()
+    metrics.counters.clear()
+
+    result = {
+        'kind': kind,
+        'messages': len(messages),
+        'seconds': elapsed,
+        'msgs_per_sec': len(messages) / elapsed if elapsed else 0.0,
+        'phases': phases(snapshot)}
+
+    if tracemalloc is not None:
+        allocated = messages[:args.allocations]
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        drive(allocated, envpath)
+        after = tracemalloc.take_snapshot()
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = after.compare_to(before, 'filename')
+        result['allocations'] = {
+            'messages': len(allocated),
+            'peak_bytes': peak,
+            'retained_bytes_per_msg':
+                sum(stat.size_diff for stat in stats) / len(allocated),
+            'retained_blocks_per_msg':
+                sum(stat.count_diff for stat in stats) / len(allocated)}
+
+    return result
+
+
+def report(result):
+    sys.stdout.write(
+        '%-9s %8d msgs %8.3f s %10.1f msgs/s\n' % (
+            result['kind'], result['messages'], result['seconds'],
+            result['msgs_per_sec']))
+
+    for name in s_phases:
+        phase = result['phases'].get(name)
+        if phase is None:
+            continue
+        sys.stdout.write(
+            '    %-10s mean %9.1f us  p50 <= %9.1f us  p99 <= %9.1f us  '
+            'max %9.1f us\n' % (
+                name, phase['mean'] * 1e6, phase['p50'] * 1e6,
+                phase['p99'] * 1e6, phase['max'] * 1e6))
+
+    allocations = result.get('allocations')
+    if allocations is not None:
+        sys.stdout.write(
+            '    allocations: peak %d KiB, retained %.1f bytes / %.2f blocks'
+            ' per msg\n' % (
+                allocations['peak_bytes'] // 1024,
+                allocations['retained_bytes_per_msg'],
+                allocations['retained_blocks_per_msg']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sparkl_bench',
+        description='Benchmarks the SPARKL message handling path')
+    parser.add_argument(
+        '--kind', dest='kinds', action='append', choices=s_kinds,
+        help='service kind to benchmark, repeatable (default all)')
+    parser.add_argument('--ops', type=int, default=4, help='ops per service')
+    parser.add_argument(
+        '--fields', type=int, default=8, help='fields per event')
+    parser.add_argument(
+        '--props', type=int, default=2, help='props per service')
+    parser.add_argument(
+        '--size', type=int, default=64,
+        help='bytes of each field and prop value')
+    parser.add_argument(
+        '--messages', type=int, default=2000, help='data events per pass')
+    parser.add_argument(
+        '--warmup', type=int, default=100, help='data events to warm up with')
+    parser.add_argument(
+        '--allocations', type=int, default=500,
+        help='data events in the allocation pass')
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help='also write the results as JSON, for comparison between runs')
+    args = parser.parse_args(argv)
+
+    envpath = tempfile.mkdtemp(prefix='sparkl_bench_')
+    try:
+        stubs.install(envpath)
+        metrics.enabled = False
+
+        results = []
+        for kind in args.kinds or s_kinds:
+            result = bench(kind, args, envpath)
+            report(result)
+            results.append(result)
+    finally:
+        shutil.rmtree(envpath, True)
+
+    if args.json:
+        dst_ = open(args.json, 'w')
+        json.dump(results, dst_, indent=2)
+        dst_.close()
+
+
+if __name__ == '__main__':
+    main()
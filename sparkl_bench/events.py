@@ -0,0 +1,203 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Synthetic SPARKL events, of configurable size, for benchmarking.
+"""
+
+import random
+import string
+
+import sparkl_services as ss
+
+s_reply = 'Ok'
+
+
+def opname(index):
+    return 'Op' + str(index)
+
+
+def opid(index):
+    return 'O-' + str(index)
+
+
+def fieldname(index):
+    return 'f' + str(index)
+
+
+def fieldid(index):
+    return 'F-' + str(index)
+
+
+def payload(size, rand):
+    return ''.join(rand.choice(string.ascii_letters) for _ in range(size))
+
+
+def openevent(
+        instanceid, provision, ops, fields, props, size, language=None,
+        script=None, seed=0):
+    """
+    Builds an open event for a service instance
+
+    :type: str
+    :param instanceid: id of the service instance
+
+    :type: str
+    :param provision: service type, e.g. docker or script
+
+    :type: int
+    :param ops: number of request ops, each with a single reply
+
+    :type: int
+    :param fields: number of (string) fields, passed in and out of every op
+
+    :type: int
+    :param props: number of props of the service, other than the script
+
+    :type: int
+    :param size: bytes of each prop value
+
+    :type: str
+    :param language: script language, where a script service
+
+    :type: str
+    :param script: script source, where a script service
+    """
+
+    rand = random.Random(seed)
+
+    requests = [
+        {ss.s_tag: ss.s_op_rr,
+         ss.s_attributes: {ss.s_id: opid(index), ss.s_name: opname(index)},
+         ss.s_content: [
+             {ss.s_tag: 'reply',
+              ss.s_attributes: {
+                  ss.s_id: 'R-' + str(index), ss.s_name: s_reply}}]}
+        for index in range(ops)]
+
+    fieldsmd = [
+        {ss.s_tag: ss.s_fieldtag,
+         ss.s_attributes: {
+             ss.s_id: fieldid(index),
+             ss.s_name: fieldname(index),
+             ss.s_type: 'string'}}
+        for index in range(fields)]
+
+    propsmd = [
+        {ss.s_tag: ss.s_prop,
+         ss.s_attributes: {
+             ss.s_name: 'bench.p' + str(index), ss.s_type: 'string'},
+         ss.s_content: [payload(size, rand)]}
+        for index in range(props)]
+
+    if script is not None:
+        propsmd.append(
+            {ss.s_tag: ss.s_prop,
+             ss.s_attributes: {
+                 ss.s_name: ss.s_script_src, ss.s_type: language},
+             ss.s_content: [script]})
+
+    return {
+        ss.s_tag: ss.et_open,
+        ss.s_attributes: {ss.s_ref: instanceid},
+        ss.s_content: [
+            {ss.s_tag: ss.s_op_rrs, ss.s_content: requests},
+            {ss.s_tag: ss.s_fieldstag, ss.s_content: fieldsmd},
+            {ss.s_tag: ss.s_service,
+             ss.s_attributes: {ss.s_provision: provision},
+             ss.s_content: propsmd}]}
+
+
+def dataevents(instanceid, ops, fields, size, count, seed=0):
+    """
+    Builds data events requesting the ops of a service instance in turn
+
+    :type: int
+    :param size: bytes of each field value
+
+    :type: int
+    :param count: number of events
+
+    :rtype: list
+    :return: the events
+    """
+
+    rand = random.Random(seed)
+
+    return [
+        dataevent(instanceid, 'E-' + str(index), index % ops, fields, size,
+                  rand)
+        for index in range(count)]
+
+
+def dataevent(instanceid, eventid, opindex, fields, size, rand):
+    """
+    Builds a data event requesting an op of a service instance
+
+    :type: int
+    :param opindex: index of the op requested
+
+    :type: random.Random
+    :param rand: source of the field values
+    """
+
+    return {
+        ss.s_tag: ss.et_dataevent,
+        ss.s_attributes: {
+            ss.s_ref: instanceid,
+            ss.s_id: eventid,
+            ss.s_subject: opid(opindex)},
+        ss.s_content: [
+            {ss.s_tag: ss.s_datumtag,
+             ss.s_attributes: {ss.s_fieldtag: fieldid(field)},
+             ss.s_content: [payload(size, rand)]}
+            for field in range(fields)]}
+
+
+def pythonscript(ops):
+    """
+    Gives a python script service, each op replying with its input fields
+    """
+
+    lines = ['def op(collect, fields):\n',
+             '    return True, \'' + s_reply + '\', {}\n',
+             '\n',
+             'mixops = {\n']
+    lines.extend(
+        '    \'' + opname(index) + '\': op,\n' for index in range(ops))
+    lines.append('}\n')
+    return ''.join(lines)
+
+
+def eclipsescript(ops):
+    """
+    Gives an eclipse-clp theory, each op replying with its input fields
+    """
+
+    return ''.join(
+        opname(index).lower() + ' :- assert(ecl__resultname(\'' +
+        s_reply + '\')).\n'
+        for index in range(ops))
+
+
+def ansiblescript(ops):
+    """
+    Gives an ansible script config, each op writing a reply result
+    """
+
+    lines = []
+    for index in range(ops):
+        lines.extend([
+            opname(index).lower() + ':\n',
+            '  tasks:\n',
+            '    - copy:\n',
+            '        content: \'{"outputname": "' + s_reply +
+            '", "fields": {}}\'\n',
+            '        dest: "{{ __resultfile }}"\n'])
+    return ''.join(lines)
+
+
+def callback(_opname, _fields):
+    """
+    Container callback, replying with the input fields
+    """
+    return True, s_reply, {}
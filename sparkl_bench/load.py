@@ -0,0 +1,391 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+End-to-end load harness. Runs a real container process against a local
+stand-in SPARKL server, which sends it an open event for a python script
+service, then drives a load profile of data events at it, recording
+throughput, latency and the container's memory over time.
+
+Profiles:
+    steady  - requests for the fast op at a fixed rate
+    bursty  - bursts of requests for the fast op, at a fixed period
+    mixed   - requests at a fixed rate, spread over the fast, cpu-bound
+              and slow ops
+    slow    - requests for the fast op at a fixed rate, with one for the
+              slow op interleaved every so often
+
+Run as:  python -m sparkl_bench.load --help
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import sparkl_services as ss
+from sparkl_bench import events
+from sparkl_bench.server import FakeServer, ConnectionClosed
+
+s_instance = 'I-load'
+s_processid = 'P-load'
+s_urlstub = 'sparkl'
+
+# ops of the service, by index
+OP_FAST = 0
+OP_WORK = 1
+OP_SLOW = 2
+
+s_profiles = ['steady', 'bursty', 'mixed', 'slow']
+
+s_script = '''
+import time
+
+def fast(collect, fields):
+    return True, 'Ok', {}
+
+def work(collect, fields):
+    total = 0
+    for index in range(%d):
+        total += index * index
+    return True, 'Ok', {}
+
+def slow(collect, fields):
+    time.sleep(%f)
+    return True, 'Ok', {}
+
+mixops = {'Op0': fast, 'Op1': work, 'Op2': slow}
+'''
+
+
+def schedule(args):
+    """
+    Gives the requests of a load profile
+
+    :rtype: list
+    :return: (seconds from start, op index) pairs, in time order
+    """
+
+    rand = random.Random(args.seed)
+    requests = []
+
+    if args.profile == 'bursty':
+        at = 0.0
+        while at < args.duration:
+            requests.extend((at, OP_FAST) for _ in range(args.burst))
+            at += args.period
+        return requests
+
+    interval = 1.0 / args.rate
+    count = int(args.duration * args.rate)
+    for index in range(count):
+        if args.profile == 'mixed':
+            opindex = rand.choice(
+                [OP_FAST] * 6 + [OP_WORK] * 3 + [OP_SLOW])
+        elif args.profile == 'slow' and index % args.slowevery == 0:
+            opindex = OP_SLOW
+        else:
+            opindex = OP_FAST
+        requests.append((index * interval, opindex))
+
+    return requests
+
+
+def launch(port, workdir, envdir, logfile=None, workers=None):
+    """
+    Runs container.py, as it is run for real, connecting to the given port,
+    its output going to the log file, if any, and handling events on the
+    given number of worker threads, if any
+    """
+
+    root = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..'))
+
+    # container.py finds extension scripts relative to its priv directory
+    privdir = os.path.join(workdir, 'sparkl', 'priv')
+    os.makedirs(privdir)
+    container = os.path.join(privdir, 'container.py')
+    shutil.copy(os.path.join(root, 'sparkl_script', 'container.py'), container)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    if workers is not None:
+        env['SPARKL_WS_WORKERS'] = str(workers)
+
+    output = open(logfile, 'w') if logfile else open(os.devnull, 'w')
+    try:
+        return subprocess.Popen(
+            [sys.executable, container, '127.0.0.1', str(port), s_processid,
+             s_urlstub, 'false', envdir],
+            env=env,
+            cwd=workdir,
+            stdout=output,
+            stderr=subprocess.STDOUT)
+    finally:
+        output.close()
+
+
+def rss(pid):
+    """
+    Gives the resident memory of a process, in KiB, where known
+    """
+
+    try:
+        src_ = open('/proc/' + str(pid) + '/status')
+    except (IOError, OSError):
+        return None
+
+    try:
+        for line in src_:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    finally:
+        src_.close()
+    return None
+
+
+class Recorder(object):
+    """
+    Correlates replies with the requests they answer, by event id, and
+    keeps a per-second timeline.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.latencies = []
+        self.errors = 0
+        self.timeline = {}
+        self.done = threading.Event()
+        self.expected = None
+
+    def second(self, at):
+        index = int(at - self.started)
+        slot = self.timeline.get(index)
+        if slot is None:
+            slot = self.timeline[index] = {
+                'second': index, 'sent': 0, 'replied': 0, 'rss_kb': None}
+        return slot
+
+    def sent(self, eventid):
+        now = time.time()
+        with self.lock:
+            self.pending[eventid] = now
+            self.second(now)['sent'] += 1
+
+    def received(self, message):
+        now = time.time()
+        decoded = json.loads(message)
+        replies = decoded if isinstance(decoded, list) else [decoded]
+
+        with self.lock:
+            for reply in replies:
+                attrs = reply.get('attr', {})
+                sent = self.pending.pop(attrs.get('ref'), None)
+                if sent is None:
+                    continue
+                self.latencies.append(now - sent)
+                if reply.get('tag') == 'error_event':
+                    self.errors += 1
+                self.second(now)['replied'] += 1
+
+            if self.expected is not None and \
+                    len(self.latencies) >= self.expected:
+                self.done.set()
+
+    def memory(self, kb):
+        with self.lock:
+            self.second(time.time())['rss_kb'] = kb
+
+
+def receive(conn, recorder):
+    try:
+        while True:
+            recorder.received(conn.receive())
+    except (ConnectionClosed, IOError, OSError, ValueError):
+        recorder.done.set()
+
+
+def sample(pid, recorder, stop):
+    while not stop.wait(1.0):
+        recorder.memory(rss(pid))
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(args):
+    """
+    Runs a load profile against a container
+
+    :rtype: dict
+    :return: summary and timeline
+    """
+
+    requests = schedule(args)
+    rand = random.Random(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix='sparkl_load_')
+    envdir = os.path.join(workdir, 'env')
+    os.makedirs(envdir)
+
+    server = FakeServer()
+    process = launch(
+        server.port, workdir, envdir, args.container_log, args.workers)
+    conn = None
+
+    try:
+        conn = server.accept(args.connect_timeout)
+
+        script = s_script % (args.work, args.slow)
+        conn.send(json.dumps(events.openevent(
+            s_instance, ss.s_type_scriptservice, 3, args.fields, args.props,
+            args.size, 'python', script)))
+
+        started = time.time()
+        recorder = Recorder(started)
+        recorder.expected = len(requests)
+
+        reader = threading.Thread(target=receive, args=(conn, recorder))
+        reader.daemon = True
+        reader.start()
+
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=sample, args=(process.pid, recorder, stop))
+        sampler.daemon = True
+        sampler.start()
+
+        for index, (at, opindex) in enumerate(requests):
+            delay = started + at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            eventid = 'E-' + str(index)
+            message = json.dumps(events.dataevent(
+                s_instance, eventid, opindex, args.fields, args.size, rand))
+            recorder.sent(eventid)
+            conn.send(message)
+
+        sentall = time.time()
+        recorder.done.wait(args.drain)
+        finished = time.time()
+        stop.set()
+
+    finally:
+        if conn is not None:
+            conn.close()
+        server.close()
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, True)
+
+    ordered = sorted(recorder.latencies)
+    replied = len(ordered)
+
+    return {
+        'profile': args.profile,
+        'connect_params': conn.params,
+        'sent': len(requests),
+        'replied': replied,
+        'errors': recorder.errors,
+        'unanswered': len(recorder.pending),
+        'seconds': finished - started,
+        'send_seconds': sentall - started,
+        'msgs_per_sec': replied / (finished - started),
+        'latency': {
+            'p50': percentile(ordered, 0.5),
+            'p95': percentile(ordered, 0.95),
+            'p99': percentile(ordered, 0.99),
+            'max': ordered[-1] if ordered else None},
+        'timeline': [
+            recorder.timeline[index] for index in sorted(recorder.timeline)]}
+
+
+def report(result):
+    def ms(value):
+        return '-' if value is None else '%.2f ms' % (value * 1000)
+
+    latency = result['latency']
+    sys.stdout.write(
+        '%s: %d sent, %d replied, %d errors, %d unanswered, %.1f msgs/s\n'
+        '    latency p50 %s  p95 %s  p99 %s  max %s\n' % (
+            result['profile'], result['sent'], result['replied'],
+            result['errors'], result['unanswered'], result['msgs_per_sec'],
+            ms(latency['p50']), ms(latency['p95']), ms(latency['p99']),
+            ms(latency['max'])))
+
+    for slot in result['timeline']:
+        sys.stdout.write(
+            '    %4ds  sent %6d  replied %6d  rss %s\n' % (
+                slot['second'], slot['sent'], slot['replied'],
+                '-' if slot['rss_kb'] is None else
+                str(slot['rss_kb']) + ' KiB'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sparkl_bench.load',
+        description='Drives a load profile at a container, by way of a '
+                    'stand-in SPARKL server')
+    parser.add_argument(
+        '--profile', choices=s_profiles, default='steady')
+    parser.add_argument(
+        '--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument(
+        '--rate', type=float, default=200,
+        help='requests per second, for steady, mixed and slow')
+    parser.add_argument(
+        '--burst', type=int, default=200, help='requests per burst')
+    parser.add_argument(
+        '--period', type=float, default=1, help='seconds between bursts')
+    parser.add_argument(
+        '--slowevery', type=int, default=50,
+        help='one slow request in this many, for slow')
+    parser.add_argument(
+        '--slow', type=float, default=0.5,
+        help='seconds taken by the slow op')
+    parser.add_argument(
+        '--work', type=int, default=20000,
+        help='loop iterations of the cpu-bound op')
+    parser.add_argument('--fields', type=int, default=4)
+    parser.add_argument('--props', type=int, default=0)
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--connect-timeout', type=float, default=30,
+        help='seconds to wait for the container to connect')
+    parser.add_argument(
+        '--drain', type=float, default=30,
+        help='seconds to wait for outstanding replies')
+    parser.add_argument(
+        '--workers', type=int,
+        help='worker threads of the container, as SPARKL_WS_WORKERS; '
+             'slow ops hold up the rest without them')
+    parser.add_argument(
+        '--container-log', metavar='FILE',
+        help='file for the output of the container, discarded by default')
+    parser.add_argument(
+        '--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    report(result)
+
+    if args.json:
+        dst_ = open(args.json, 'w')
+        json.dump(result, dst_, indent=2)
+        dst_.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Replays the inbound frames of a capture file, as recorded by the transport
+where SPARKL_WS_RECORD is set, through sparkl_services.handle_msg, at the
+original speed, a multiple of it, or as fast as possible, reporting how
+long each frame took to handle and how far behind the capture's own timing
+the replay fell.
+
+Run as:  python -m sparkl_bench.replay --help
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+import sparkl_services as ss
+from sparkl_services import capture
+from sparkl_bench import stubs
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def replay(path, speed, envpath):
+    """
+    Replays the inbound frames of a capture
+
+    :type: str
+    :param path: capture file
+
+    :type: float
+    :param speed: multiple of the original speed, 0 for as fast as possible
+
+    :type: str
+    :param envpath: location of instance env directory
+
+    :rtype: dict
+    :return: counts, timings and lag
+    """
+
+    collected = []
+    ss.handle = collected.append
+
+    frames = 0
+    replies = 0
+    errors = 0
+    recorded = 0
+    latencies = []
+    lag = 0.0
+
+    first = None
+    started = time.time()
+
+    for direction, timestamp, frame in capture.read(path):
+        if direction == capture.OUTBOUND:
+            recorded += 1
+            continue
+
+        if first is None:
+            first = timestamp
+        if speed > 0:
+            due = started + (timestamp - first) / speed
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+
+        since = time.time()
+        reply = ss.handle_msg(frame, envpath)
+        for event in reply if isinstance(reply, list) else [reply]:
+            if event is None:
+                continue
+            ss.encode_msg(event)
+            replies += 1
+            if event.get(ss.s_tag) == ss.et_errorevent:
+                errors += 1
+        latencies.append(time.time() - since)
+        frames += 1
+
+    elapsed = time.time() - started
+    ordered = sorted(latencies)
+
+    return {
+        'frames': frames,
+        'replies': replies,
+        'collected': len(collected),
+        'errors': errors,
+        'recorded_outbound': recorded,
+        'seconds': elapsed,
+        'frames_per_sec': frames / elapsed if elapsed else 0.0,
+        'max_lag': lag,
+        'latency': {
+            'p50': percentile(ordered, 0.5),
+            'p99': percentile(ordered, 0.99),
+            'max': ordered[-1] if ordered else None}}
+
+
+def report(result):
+    def ms(value):
+        return '-' if value is None else '%.2f ms' % (value * 1000)
+
+    latency = result['latency']
+    sys.stdout.write(
+        '%d frames in %.3f s, %.1f frames/s, max lag %s\n'
+        '    %d replies (%d errors) and %d collected events, against %d '
+        'outbound frames recorded\n'
+        '    handling p50 %s  p99 %s  max %s\n' % (
+            result['frames'], result['seconds'], result['frames_per_sec'],
+            ms(result['max_lag']), result['replies'], result['errors'],
+            result['collected'], result['recorded_outbound'],
+            ms(latency['p50']), ms(latency['p99']), ms(latency['max'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m sparkl_bench.replay',
+        description='Replays a capture of websocket traffic through '
+                    'handle_msg')
+    parser.add_argument('capture', help='capture file')
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help='multiple of the original speed, 0 for as fast as possible')
+    parser.add_argument(
+        '--max', dest='speed', action='store_const', const=0.0,
+        help='replay as fast as possible')
+    parser.add_argument(
+        '--stub', action='store_true',
+        help='run eclipse-clp and ansible scripts against stub executables')
+    parser.add_argument(
+        '--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    envpath = tempfile.mkdtemp(prefix='sparkl_replay_')
+    try:
+        if args.stub:
+            stubs.install(envpath)
+        result = replay(args.capture, args.speed, envpath)
+    finally:
+        shutil.rmtree(envpath, True)
+
+    report(result)
+
+    if args.json:
+        dst_ = open(args.json, 'w')
+        json.dump(result, dst_, indent=2)
+        dst_.close()
+
+
+if __name__ == '__main__':
+    main()
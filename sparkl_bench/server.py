@@ -0,0 +1,194 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Minimal stand-in for the SPARKL websocket endpoint, using only the standard
+library. Accepts a single container connection on the connect url, as built
+by container.py, and exchanges JSON text frames with it (RFC 6455).
+"""
+
+import base64
+import hashlib
+import logging
+import socket
+import struct
+import threading
+
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+s_guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+s_connect = '_ws/connect'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class FakeServer(object):
+    """
+    Listens on a local port for the container to connect.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(1)
+        self.host, self.port = self.listener.getsockname()
+
+    def accept(self, timeout=None):
+        """
+        Accepts the container's connection, completing the websocket
+        handshake
+
+        :type: float
+        :param timeout: seconds to wait for the connection
+
+        :rtype: Connection
+        """
+
+        self.listener.settimeout(timeout)
+        sock, _ = self.listener.accept()
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return Connection(sock)
+
+    def close(self):
+        self.listener.close()
+
+
+class Connection(object):
+    """
+    Server side of a websocket connection. Frames are sent from any thread,
+    and received on one.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.sendlock = threading.Lock()
+        self.path = None
+        self.params = {}
+        self.handshake()
+
+    def handshake(self):
+        requestline = self.reader.readline().decode('latin-1').split()
+        if len(requestline) < 2 or requestline[0] != 'GET':
+            raise ConnectionClosed('bad request: ' + ' '.join(requestline))
+
+        headers = {}
+        while True:
+            line = self.reader.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(requestline[1])
+        self.path = url.path
+        self.params = dict(
+            (name, values[-1]) for name, values in parse_qs(url.query).items())
+        logger.debug('connect %s %s', self.path, self.params)
+
+        key = headers.get('sec-websocket-key')
+        if key is None or s_connect not in self.path:
+            self.sock.sendall(b'HTTP/1.1 404 Not Found\r\n\r\n')
+            raise ConnectionClosed('not a connect request: ' + self.path)
+
+        accept = base64.b64encode(
+            hashlib.sha1((key + s_guid).encode('ascii')).digest())
+        self.sock.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+    def send(self, text, opcode=OP_TEXT):
+        """
+        Sends a frame, unmasked as from a server
+
+        :type: str
+        :param text: frame payload
+        """
+
+        payload = text.encode('utf-8') if not isinstance(text, bytes) \
+            else text
+        length = len(payload)
+
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+        with self.sendlock:
+            self.sock.sendall(header + payload)
+
+    def receive(self):
+        """
+        Receives the next text message, answering pings on the way
+
+        :rtype: str
+        :return: the message
+        """
+
+        chunks = []
+        while True:
+            fin, opcode, payload = self.frame()
+
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+            elif opcode == OP_PONG:
+                pass
+            elif opcode == OP_CLOSE:
+                raise ConnectionClosed('closed by container')
+            else:
+                chunks.append(payload)
+                if fin:
+                    return b''.join(chunks).decode('utf-8')
+
+    def frame(self):
+        header = self.read(2)
+        fin = header[0] & 0x80
+        opcode = header[0] & 0x0F
+        masked = header[1] & 0x80
+        length = header[1] & 0x7F
+
+        if length == 126:
+            length = struct.unpack('!H', self.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.read(8))[0]
+
+        mask = self.read(4) if masked else None
+        payload = self.read(length)
+
+        if mask is not None:
+            # unmasked in one go, by way of big integers
+            repeated = (mask * (length // 4 + 1))[:length]
+            payload = (
+                int.from_bytes(payload, 'big') ^
+                int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+        return fin, opcode, payload
+
+    def read(self, size):
+        data = self.reader.read(size)
+        if len(data) < size:
+            raise ConnectionClosed('connection lost')
+        return data
+
+    def close(self):
+        try:
+            self.send(struct.pack('!H', 1000), OP_CLOSE)
+        except (IOError, OSError):
+            pass
+        self.sock.close()
@@ -0,0 +1,83 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Stub eclipse and ansible-playbook executables, standing in for the real ones
+when benchmarking, so that what is measured is the cost of the handling path
+and process management rather than that of the script engines. Each writes
+a reply result, with no output fields, for every goal or play it is given,
+other than an ansible play with a fail task, which writes none.
+"""
+
+import os
+import stat
+import sys
+
+s_result = '{"outputname": "Ok", "fields": {}}'
+
+# serves goals from input where run with -e serve__, otherwise writes the
+# result to the file given in the do__it goal of the theory
+s_eclipse = '''
+import re
+import sys
+
+result = %r
+
+if sys.argv[-1] == 'serve__':
+    for line in sys.stdin:
+        sys.stdout.write('ecl__result:' + result + '\\n')
+        sys.stdout.flush()
+else:
+    theory = open(sys.argv[sys.argv.index('-f') + 1]).read()
+    path = re.search(r'do__it\\("([^"]*)"', theory).group(1)
+    dst_ = open(path, 'w')
+    dst_.write(result)
+    dst_.close()
+'''
+
+# writes the result to the result file of every play in the playbook, but
+# for those failing, as the rescue of a batched play removes it
+s_ansible = '''
+import sys
+import yaml
+
+result = %r
+
+def failed(tasks):
+    return any(
+        'fail' in task or failed(task.get('block', []))
+        for task in tasks or [])
+
+for play in yaml.safe_load(open(sys.argv[-1])):
+    if failed(play.get('tasks')):
+        continue
+    dst_ = open(play['vars']['__resultfile'], 'w')
+    dst_.write(result)
+    dst_.close()
+'''
+
+
+def write(path, source):
+    dst_ = open(path, 'w')
+    dst_.write('#!' + sys.executable + '\n')
+    dst_.write(source % s_result)
+    dst_.close()
+    os.chmod(path, stat.S_IRWXU)
+    return path
+
+
+def install(bindir):
+    """
+    Writes the stub executables, and has sparkl_script run them in place of
+    the real ones
+
+    :type: str
+    :param bindir: directory to write the stubs to
+    """
+
+    import sparkl_script
+
+    sparkl_script.eclipse_command = \
+        write(os.path.join(bindir, 'eclipse'), s_eclipse)
+    sparkl_script.ansible_command = \
+        write(os.path.join(bindir, 'ansible-playbook'), s_ansible)
+    sparkl_script.ansible_sudo = ''
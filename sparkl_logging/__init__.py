@@ -2,24 +2,115 @@
 Copyright 2016 Sparkl Limited. All Rights Reserved.
 Authors: Andrew Farrell <ahfarrell@sparkl.com>
 Library for handling logging.
+Records are handed to a queue and written to file by a background listener
+thread, so that the threads handling requests do not block on file I/O.
 """
+import atexit
 import logging
 import os
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    QueueHandler = None
+    QueueListener = None
+
+# log level, by name, unless given to setlogger
+s_level_env = 'SPARKL_LOG_LEVEL'
+s_level_default = 'DEBUG'
+
+s_format = '%(asctime)s,%(msecs)d %(name)s %(levelname)s' + \
+    '%(message)s line:%(lineno)d'
+s_datefmt = '%H:%M:%S'
+
+listener = None
+
+# log file and level, as configured by setlogger, for worker processes
+logfile = None
+loglevel = None
+
 
 def getlogger(name):
     return logging.getLogger(name)
 
 
-def setlogger(filename, name, path=None):
+def getlevel(level=None):
+    """
+    Resolves a log level, given by name or number, defaulting to the
+    level named by the SPARKL_LOG_LEVEL environment variable. An unknown
+    name gives the default level, with a warning.
+    """
+    if level is None:
+        level = os.environ.get(s_level_env, s_level_default)
+    if isinstance(level, int):
+        return level
+
+    resolved = logging.getLevelName(str(level).upper())
+    if not isinstance(resolved, int):
+        logging.getLogger(__name__).warning(
+            'unknown log level %r, using %s', level, s_level_default)
+        return logging.getLevelName(s_level_default)
+    return resolved
+
+
+def setlogger(filename, name, path=None, level=None):
+    global listener, logfile, loglevel
+
     if path is not None:
         filename = os.path.join(path, filename)
 
-    logging.basicConfig(
-        filename=filename,
-        filemode='w',
-        format='%(asctime)s,%(msecs)d %(name)s %(levelname)s' +
-               '%(message)s line:%(lineno)d',
-        datefmt='%H:%M:%S',
-        level=logging.DEBUG)
+    root = logging.getLogger()
+
+    # as with logging.basicConfig, only configure once
+    if root.handlers:
+        return getlogger(name)
+
+    logfile = filename
+
+    # truncated, and then appended to, as is done by worker processes
+    # logging to the same file
+    open(filename, 'w').close()
+    filehandler = logging.FileHandler(filename, 'a')
+    filehandler.setFormatter(logging.Formatter(s_format, s_datefmt))
+
+    if QueueHandler is None:
+        root.addHandler(filehandler)
+    else:
+        records = queue.Queue(-1)
+        root.addHandler(QueueHandler(records))
+        listener = QueueListener(records, filehandler)
+        listener.start()
+        atexit.register(listener.stop)
+
+    # resolved once logging to the file, for any warning to be seen there
+    loglevel = getlevel(level)
+    root.setLevel(loglevel)
+
     return getlogger(name)
+
+
+def resetlogger(filename, level):
+    """
+    Configures logging in a worker process, e.g. as a process pool
+    initializer, given the log file and level of its parent.
+    Handlers inherited from the parent are dropped, as no listener thread
+    runs in the worker to drain their queue, and records are written
+    straight to the parent's log file, appended to.
+    """
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if filename is None:
+        return
+
+    root.setLevel(level)
+    filehandler = logging.FileHandler(filename, 'a')
+    filehandler.setFormatter(logging.Formatter(s_format, s_datefmt))
+    root.addHandler(filehandler)
@@ -9,13 +9,25 @@ a script either as an ansible playbook, eclipse-clp script, or python function.
 import yaml
 import json
 import os
+import sys
 import logging
-import shutil
-from subprocess import call
-from datetime import datetime
-import imp
+from subprocess import call, Popen
+import sparkl_logging
 import sparkl_services
-import random
+import threading
+import multiprocessing
+import tempfile
+import time
+from sparkl_script.eclipse import EclipsePool
+from sparkl_script.scratch import ScratchPool, propskey
+from sparkl_script.modcache import ModuleCache, sourcekey
+from sparkl_script import bytecode
+
+# C-accelerated safe yaml loader and dumper, where available
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
 
 logger = logging.getLogger(__name__)
 
@@ -41,7 +53,207 @@ LANGUAGE_ANSIBLE = "ansible"
 TYPE_TIME = "time"
 FIELD_TYPES = {"boolean", "float", "integer", "string"}
 
-loaded_code = {}
+# script execution is thread safe, each execution having its own working
+# directory rather than changing that of the process
+threadsafe = True
+
+# context of the script execution in progress on each thread
+context = threading.local()
+
+# loaded python script modules - maximum number kept
+python_module_cache = int(os.environ.get('SPARKL_PY_MODULE_CACHE', 64))
+
+loaded_code = ModuleCache(
+    python_module_cache,
+    lambda key: bytecode.unloadmodule(s_py_scriptmod + key))
+
+# process pool mode for python scripts - number of worker processes, where 0
+# means scripts are run in the connection's own process; scripts run in the
+# pool have their notify events sent once they complete, so never see the
+# outbound queue's backpressure, collect always giving them True
+python_processes = int(os.environ.get('SPARKL_PY_PROCESSES', 0))
+
+# process pool mode - maximum number of concurrent executions per instance
+python_instance_concurrency = \
+    int(os.environ.get('SPARKL_PY_INSTANCE_CONCURRENCY', 2))
+
+python_pool = None
+python_pool_lock = threading.Lock()
+instance_slots = {}
+
+# eclipse-clp worker pool - number of persistent eclipse processes per
+# theory, where 0 means a process is run per request. Off by default, as
+# facts asserted by a theory carry over between the goals a process serves
+eclipse_workers = int(os.environ.get('SPARKL_ECLIPSE_WORKERS', 0))
+
+# eclipse-clp executable, overridable e.g. with a stub for benchmarking
+eclipse_command = os.environ.get('SPARKL_ECLIPSE_COMMAND', 'eclipse')
+
+# eclipse-clp worker pool - number of goals after which a process is recycled
+eclipse_recycle = int(os.environ.get('SPARKL_ECLIPSE_RECYCLE', 1000))
+
+eclipse_pools = {}
+eclipse_pools_lock = threading.Lock()
+
+# parsed ansible script configs, keyed by content hash
+ansible_scripts = {}
+
+# ansible batching - seconds for which concurrent requests for the same op
+# are coalesced into a single playbook run, where 0 means no batching
+ansible_batch_window = float(
+    os.environ.get('SPARKL_ANSIBLE_BATCH_WINDOW', 0))
+
+# ansible batching - maximum number of requests (plays) in a playbook run
+ansible_batch_max = int(os.environ.get('SPARKL_ANSIBLE_BATCH_MAX', 32))
+
+# ansible-playbook executable, and the command it is run under to have
+# privileges (none where empty), overridable e.g. with a stub for benchmarking
+ansible_command = os.environ.get('SPARKL_ANSIBLE_COMMAND', 'ansible-playbook')
+ansible_sudo = os.environ.get('SPARKL_ANSIBLE_SUDO', 'sudo')
+
+# ansible fact gathering - 'gather' on every run, 'cached' between runs,
+# or 'none'
+ansible_facts = os.environ.get('SPARKL_ANSIBLE_FACTS', 'gather')
+ansible_fact_cache = os.environ.get(
+    'SPARKL_ANSIBLE_FACT_CACHE',
+    os.path.join(tempfile.gettempdir(), 'sparkl_ansible_facts'))
+
+# scratch environments - root directory, e.g. on tmpfs, defaulting to the
+# instance env directory
+scratch_root = os.environ.get('SPARKL_SCRATCH_ROOT')
+
+scratch_pools = {}
+scratch_pools_lock = threading.Lock()
+
+# references to the state shared by execution plans - modules, eclipse-clp
+# pools, ansible configs and prop files - counted over the plans of the live
+# service instances, by (release function, key)
+plan_refs = {}
+plan_refs_lock = threading.Lock()
+
+# in-memory result channel - whether one-shot eclipse-clp runs write their
+# result to an inherited pipe rather than the result file; the pipe is
+# passed by Popen's pass_fds, which Python 2 does not have
+result_pipes = \
+    os.environ.get('SPARKL_RESULT_PIPES', 'true') == 'true' and \
+    os.path.isdir('/dev/fd') and \
+    sys.version_info >= (3, 2)
+
+ANSIBLE_FACTS_CACHED = 'cached'
+ANSIBLE_FACTS_NONE = 'none'
+
+
+class ExecutionPlan(object):
+    """
+    Everything needed to execute a script operation which does not change
+    between open events for its service instance, so that a request only
+    needs to bind its fields.
+    """
+
+    __slots__ = (
+        'instanceid', 'opname', 'language', 'script', 'scriptkey', 'props',
+        'propskey', 'executor', 'play')
+
+    def __init__(self, instanceid, opname, language, script, props):
+        self.instanceid = instanceid
+        self.opname = opname
+        self.language = language
+        self.script = script
+        self.scriptkey = sourcekey(script)
+        self.props = props
+        self.propskey = propskey(props)
+        self.executor = EXECUTORS.get(language, ansible_executor)
+
+        # ansible vars and tasks for the op, once parsed
+        self.play = None
+
+    def __repr__(self):
+        return 'ExecutionPlan(' + str(self.instanceid) + ', ' + \
+            str(self.opname) + ', ' + str(self.language) + ')'
+
+
+def retain_plans(plans):
+    """
+    Counts the references of execution plans to the state they share
+
+    :type: iterable
+    :param plans: ExecutionPlans
+    """
+
+    with plan_refs_lock:
+        for plan in plans:
+            for ref in planrefs(plan):
+                plan_refs[ref] = plan_refs.get(ref, 0) + 1
+
+
+def release_plans(plans):
+    """
+    Drops the references of execution plans, releasing the state no longer
+    referenced by any plan
+
+    :type: iterable
+    :param plans: ExecutionPlans, as given to retain_plans
+    """
+
+    released = []
+    with plan_refs_lock:
+        for plan in plans:
+            for ref in planrefs(plan):
+                count = plan_refs.get(ref, 0) - 1
+                if count > 0:
+                    plan_refs[ref] = count
+                else:
+                    plan_refs.pop(ref, None)
+                    released.append(ref)
+
+    for release, key in released:
+        logger.debug('releasing %s %s', release.__name__, key)
+        release(key)
+
+
+def release_instance(instanceid, plans):
+    """
+    Releases the script state of a service instance being torn down
+
+    :type: str
+    :param instanceid: id of the service instance
+
+    :type: iterable
+    :param plans: its ExecutionPlans
+    """
+
+    instance_slots.pop(instanceid, None)
+    release_plans(plans)
+
+
+def planrefs(plan):
+    return [(RELEASERS[plan.executor], plan.scriptkey),
+            (release_props, plan.propskey)]
+
+
+def release_python(key):
+    loaded_code.discard(key)
+    bytecode.discard(key)
+
+
+def release_eclipse(key):
+    with eclipse_pools_lock:
+        pool = eclipse_pools.pop(key, None)
+
+    if pool is not None:
+        pool.close()
+
+
+def release_ansible(key):
+    ansible_scripts.pop(key, None)
+
+
+def release_props(key):
+    with scratch_pools_lock:
+        pools = list(scratch_pools.values())
+
+    for pool in pools:
+        pool.forget(key)
 
 
 def executeresults(
@@ -83,62 +295,226 @@ def executeresults(
     :return: tuple giving success, output name, and output fields
     """
 
-    # make an "environment" directory for dumping stuff
-    now = str((datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()). \
-        replace(".", "") + str(random.random())[1:]
-    envpath = os.path.join(envpath_, now)
-    envsubdir = os.path.join(envpath, sparkl_services.s_envsdir)
-    resultfile = os.path.join(envpath, s_value_resultfile)
+    plan = ExecutionPlan(instanceid, opname, language, script, props)
+    return executeplan(plan, fields, fieldnames, collect, envpath_)
+
+
+def executeplan(plan, fields, fieldnames, collect, envpath_):
+    """
+    Executes a script operation according to its execution plan.
+    Passes results back.
+
+    :type: ExecutionPlan
+    :param plan: execution plan of the op being executed
+
+    :type: dict
+    :param fields: field map passed in original sparkl operation to
+    script service, as field *name*/value pairs
+
+    :type: dict
+    :param fieldnames: fieldname meta-data map
+
+    :type: fun
+    :param collect function for notify events from service
+
+    :type: str
+    :param envpath_: location of instance env directory
+
+    :rtype: bool, str, dict
+    :return: tuple giving success, output name, and output fields
+    """
+
+    return runsteps(
+        executeplan_steps(plan, fields, fieldnames, collect, envpath_))
+
+
+def executeplan_steps(plan, fields, fieldnames, collect, envpath_):
+    """
+    Executes a script operation according to its execution plan, as
+    steps: yields the processes to be run, as Commands, each being sent
+    back its outcome, and lastly the results, as Done.
+    Each step may be taken on a different thread.
+    """
+
+    # get an "environment" directory for dumping stuff, with the prop files
+    # in place
+    pool = scratchpool(envpath_)
+    scratch = pool.acquire(plan.props, plan.propskey)
+    envpath = scratch.path
+    resultfile = scratch.resultfile
 
     logger.debug(envpath)
-    os.makedirs(envsubdir)
-    os.chdir(envsubdir)
-
-    for file_prop_name, file_prop_value in props:
-        prop_file = os.path.join(envsubdir, file_prop_name)
-        logger.debug(prop_file)
-        logger.debug(file_prop_value)
-        dst_ = open(prop_file, 'w')
-        dst_.writelines(file_prop_value)
-        dst_.close()
 
-    if language == LANGUAGE_PYTHON:
-        logger.debug("executing as python...")
-        ok, resultname, resultfields = \
-            execute_as_python(
-                instanceid,
-                opname,
-                envpath,
-                script,
-                fields,
-                collect,
-                sparkl_services.s_undefined)
-    elif language == LANGUAGE_ECLIPSE:
-        logger.debug("executing as eclipse-clp...")
-        ok, resultname, resultfields = \
-            execute_as_eclipse(
-                opname,
-                envpath,
-                script,
-                fields,
-                fieldnames,
-                resultfile)
-    else:
-        logger.debug("executing as ansible...")
-        ok, resultname, resultfields = \
-            execute_as_ansible(
-                opname,
-                envpath,
-                script,
-                fields,
-                fieldnames,
-                resultfile)
+    logger.debug('executing as %s...', plan.language)
+    try:
+        steps = plan.executor(
+            plan, envpath, scratch.subdir, fields, fieldnames, collect,
+            resultfile)
+
+        outcome = None
+        while True:
+            context.workdir = scratch.subdir
+            try:
+                step = steps.send(outcome)
+            finally:
+                context.workdir = None
+            if isinstance(step, Done):
+                break
+            outcome = yield step
+    finally:
+        pool.release(scratch)
 
-    shutil.rmtree(envpath)
+    ok, resultname, resultfields = step.result
+    logger.debug('%s %s %s', ok, resultname, resultfields)
 
-    logger.debug(str((ok, resultname, resultfields)))
+    yield step
+
+
+class Command(object):
+    """
+    A process to be run on behalf of a script execution, as yielded by its
+    steps. Its outcome is what the process wrote to its result pipe, if it
+    has one, or else None.
+    """
+
+    __slots__ = ('args', 'cwd', 'env', 'pipe')
+
+    def __init__(self, args, cwd, env=None, pipe=None):
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.pipe = pipe
+
+    def run(self):
+        if self.pipe is not None:
+            return self.pipe.run(self.args, self.cwd, self.env)
+        call(self.args, env=self.env, cwd=self.cwd)
+        return None
+
+    def __repr__(self):
+        return 'Command(' + ' '.join(self.args) + ')'
 
-    return ok, resultname, resultfields
+
+class Done(object):
+    """
+    The results of a script execution, as yielded last by its steps.
+    """
+
+    __slots__ = ('result',)
+
+    def __init__(self, result):
+        self.result = result
+
+
+def runsteps(steps):
+    """
+    Takes the steps of a script execution in line, running the processes
+    they yield
+
+    :rtype: bool, str, dict
+    :return: tuple giving success, output name, and output fields
+    """
+
+    step = next(steps)
+    while not isinstance(step, Done):
+        try:
+            outcome = step.run()
+        except Exception as e:
+            step = steps.throw(e)
+        else:
+            step = steps.send(outcome)
+
+    steps.close()
+    return step.result
+
+
+def workdir():
+    """
+    Gives the working directory of the script execution in progress on the
+    calling thread, which holds the prop files of the operation. Python
+    scripts should resolve relative paths against it, as the process working
+    directory is not changed for them.
+
+    :rtype: str
+    :return: working directory, or None outside of a script execution
+    """
+    return getattr(context, 'workdir', None)
+
+
+def scratchpool(envpath_):
+    """
+    Gets the scratch environment pool, under the scratch root if set, or
+    else the given instance env directory
+    """
+
+    root = scratch_root or envpath_
+
+    with scratch_pools_lock:
+        pool = scratch_pools.get(root)
+        if pool is None:
+            pool = ScratchPool(
+                root, sparkl_services.s_envsdir, s_value_resultfile)
+            scratch_pools[root] = pool
+
+    return pool
+
+
+def python_executor(
+        plan, envpath, workdir_, fields, _fieldnames, collect, _resultfile):
+    yield Done(execute_as_python(
+        plan.instanceid,
+        plan.opname,
+        envpath,
+        plan.script,
+        fields,
+        collect,
+        sparkl_services.s_undefined,
+        workdir_,
+        plan.scriptkey))
+
+
+def eclipse_executor(
+        plan, envpath, workdir_, fields, fieldnames, _collect, resultfile):
+    return eclipse_steps(
+        plan.opname,
+        envpath,
+        plan.script,
+        fields,
+        fieldnames,
+        resultfile,
+        workdir_)
+
+
+def ansible_executor(
+        plan, envpath, workdir_, fields, fieldnames, _collect, resultfile):
+    if plan.play is None:
+        plan.play = ansibleplay(plan.script, plan.opname)
+
+    return ansible_steps(
+        plan.opname,
+        envpath,
+        plan.script,
+        fields,
+        fieldnames,
+        resultfile,
+        plan.play,
+        (plan.instanceid, plan.opname),
+        workdir_)
+
+
+# the executors give the steps of a script execution
+EXECUTORS = {
+    LANGUAGE_PYTHON: python_executor,
+    LANGUAGE_ECLIPSE: eclipse_executor,
+    LANGUAGE_ANSIBLE: ansible_executor
+}
+
+# release functions of the state shared by plans, by executor
+RELEASERS = {
+    python_executor: release_python,
+    eclipse_executor: release_eclipse,
+    ansible_executor: release_ansible
+}
 
 
 def getresults(resultfile, fieldnames):
@@ -158,39 +534,143 @@ def getresults(resultfile, fieldnames):
             pass
 
         if result_ is not None:
+            resultasstr = result_.read()
+            result_.close()
+            return parseresults(resultasstr, fieldnames)
+
+    return ok, resultname, resultfields
+
+
+class ResultPipe(object):
+    """
+    In-memory result channel - a pipe, the write end of which is inherited
+    by the script process and named to it as its result file, so that the
+    result is read back without a file round-trip.
+    """
+
+    def __init__(self):
+        self.readfd, self.writefd = os.pipe()
+        self.path = '/dev/fd/' + str(self.writefd)
+
+    def run(self, cmd, workdir_, env=None):
+        """
+        Runs the script process, reading its result from the pipe until
+        the process exits.
+
+        :rtype: str
+        :return: result written, or None where nothing was written
+        """
+
+        try:
             try:
-                resultasstr = result_.read()
-                logger.debug(resultasstr)
-                resultmap = json.loads(resultasstr)
-                result_.close()
+                process = Popen(
+                    cmd, cwd=workdir_, env=env, pass_fds=(self.writefd,))
+            finally:
+                self.closewrite()
+
+            chunks = []
+            while True:
+                chunk = os.read(self.readfd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            self.close()
+
+        process.wait()
+        return b''.join(chunks).decode('utf-8') or None
+
+    def closewrite(self):
+        """
+        Closes this process's copy of the write end, once inherited by the
+        script process, so that the pipe ends with the script process
+        """
+        if self.writefd is not None:
+            os.close(self.writefd)
+            self.writefd = None
+
+    def close(self):
+        self.closewrite()
+        if self.readfd is not None:
+            os.close(self.readfd)
+            self.readfd = None
+
+
+def parseresults(resultasstr, fieldnames):
+    """
+    Parses the JSON result written by a script, where None stands for no
+    result having been written.
 
-                logger.debug(str(resultmap))
+    :rtype: bool, str, dict
+    :return: tuple giving success, output name, and output fields
+    """
 
-                resultvalue = resultmap.get(s_resultvalue)
-                if resultvalue is False:
-                    ok = False
-                else:
-                    resultname = resultmap[s_outputname]
-                    resultfields = resultmap[s_fields]
+    logger.debug(resultasstr)
 
-                for fieldname in resultfields.keys():
-                    (_fieldid, fieldtype) = fieldnames.get(fieldname)
-                    if fieldtype == "string":
-                        resultfields[fieldname] = str(resultfields[fieldname])
+    ok = True
+    resultfields = {}
+    resultname = s_OK
+
+    if resultasstr is not None:
+        try:
+            resultmap = json.loads(resultasstr)
+            logger.debug('%s', resultmap)
 
-            except (ValueError, KeyError):
+            resultvalue = resultmap.get(s_resultvalue)
+            if resultvalue is False:
                 ok = False
-                resultname = s_ERROR
+            else:
+                resultname = resultmap[s_outputname]
+                resultfields = resultmap[s_fields]
+
+            for fieldname in resultfields.keys():
+                (_fieldid, fieldtype) = fieldnames.get(fieldname)
+                if fieldtype == "string":
+                    resultfields[fieldname] = str(resultfields[fieldname])
+
+        except (ValueError, KeyError):
+            ok = False
+            resultname = s_ERROR
 
     return ok, resultname, resultfields
 
 
-def execute_as_ansible(
-        opname, envpath, scriptconfig, fields, fieldnames, resultfile):
-    # parse yaml script config
-    scriptconfigyaml_ = yaml.load(scriptconfig)
-    logger.debug(scriptconfigyaml_)
+def ansibleplay(scriptconfig, opname):
+    """
+    Gets the vars and tasks for an op from an ansible script config, the
+    config being parsed once for any given content.
+
+    :rtype: dict, list
+    :return: vars and tasks for the op
+    """
+
+    key = sourcekey(scriptconfig)
+    scriptconfigyaml_ = ansible_scripts.get(key)
+
+    if scriptconfigyaml_ is None:
+        # parse yaml script config
+        scriptconfigyaml_ = yaml.load(scriptconfig, Loader=YamlLoader)
+        logger.debug(scriptconfigyaml_)
+        ansible_scripts[key] = scriptconfigyaml_
+
     scriptconfigyaml = scriptconfigyaml_.get(opname.lower())
+    return scriptconfigyaml.get('vars'), scriptconfigyaml.get('tasks')
+
+
+def execute_as_ansible(
+        opname, envpath, scriptconfig, fields, fieldnames, resultfile,
+        play=None, batchkey=None, workdir_=None):
+    return runsteps(ansible_steps(
+        opname, envpath, scriptconfig, fields, fieldnames, resultfile, play,
+        batchkey, workdir_))
+
+
+def ansible_steps(
+        opname, envpath, scriptconfig, fields, fieldnames, resultfile,
+        play=None, batchkey=None, workdir_=None):
+    if play is None:
+        play = ansibleplay(scriptconfig, opname)
+    scriptconfigvars, tasks = play
 
     # create playbook vars map
     pb_vars = {
@@ -198,7 +678,6 @@ def execute_as_ansible(
     }
 
     # get any vars in the passed script config and update playbook vars map
-    scriptconfigvars = scriptconfigyaml.get('vars')
     if scriptconfigvars is not None:
         pb_vars.update(scriptconfigvars)
 
@@ -211,49 +690,170 @@ def execute_as_ansible(
     playbook = {
         'hosts': 'all',
         'vars': pb_vars,
-        'tasks': scriptconfigyaml.get('tasks')
+        'tasks': tasks
     }
-    logger.debug(str(playbook))
+    if ansible_facts == ANSIBLE_FACTS_NONE:
+        playbook['gather_facts'] = False
+    logger.debug('%s', playbook)
+
+    if ansible_batch_window > 0 and batchkey is not None:
+        # the batch leader runs the playbook for all, in line
+        ansible_batcher.run(batchkey, envpath, workdir_, playbook)
+
+        # a failed play leaves no result, rather than some other request's
+        # failure leaving none for this one
+        if not os.path.exists(resultfile):
+            logger.error('no result from batched play for %s', opname)
+            yield Done((False, s_ERROR, {}))
+            return
+    else:
+        yield playbookcommand(envpath, workdir_, [playbook])
+
+    yield Done(getresults(resultfile, fieldnames))
+
+
+def runplaybook(envpath, workdir_, plays):
+    """
+    Runs a playbook of one or more plays, each writing its own result file
+    """
+    playbookcommand(envpath, workdir_, plays).run()
+
+
+def playbookcommand(envpath, workdir_, plays):
+    """
+    Writes out a playbook of one or more plays, each writing its own result
+    file, giving the command to run it
+
+    :type: str
+    :param envpath: "environment" directory for the playbook file
+
+    :type: str
+    :param workdir_: working directory to run the playbook in
+
+    :type: list
+    :param plays: the plays of the playbook
+
+    :rtype: Command
+    """
 
     # dump playbook to file in "environment" directory
     playfile = os.path.join(envpath, s_value_playfile)
     dst_ = open(playfile, 'w')
-    yaml.dump([playbook], dst_)
+    yaml.dump(plays, dst_, Dumper=YamlDumper)
     dst_.close()
 
     # run the playbook
-    playcmd = "sudo ansible-playbook -i localhost, -c local " + playfile
+    playcmd = [ansible_sudo] if ansible_sudo else []
+    if ansible_facts == ANSIBLE_FACTS_CACHED:
+        # facts are gathered where not already in the cache
+        playcmd.extend([
+            'env',
+            'ANSIBLE_GATHERING=smart',
+            'ANSIBLE_CACHE_PLUGIN=jsonfile',
+            'ANSIBLE_CACHE_PLUGIN_CONNECTION=' + ansible_fact_cache])
+    playcmd.extend(
+        [ansible_command, '-i', 'localhost,', '-c', 'local', playfile])
     logger.debug(playcmd)
-    call(playcmd.split(" "), env={'PATH': '/bin:/usr/bin'})
+    return Command(playcmd, workdir_, {'PATH': '/bin:/usr/bin'})
+
+
+class AnsibleBatch(object):
+    """
+    Plays coalesced into a single playbook run.
+    """
+
+    def __init__(self):
+        self.plays = []
+        self.done = threading.Event()
+
+
+class AnsibleBatcher(object):
+    """
+    Coalesces concurrent requests for the same ansible op into a single
+    playbook run, with a play per request. The first request of a batch
+    waits out the batching window and runs the playbook, the others
+    waiting for it to complete. As each play writes its own result file,
+    the results are then read back by each request as usual. Each play is
+    isolated from the failure of the others, a failed one leaving no result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = {}
+
+    def run(self, batchkey, envpath, workdir_, playbook):
+        with self.lock:
+            batch = self.batches.get(batchkey)
+            leader = batch is None or len(batch.plays) >= ansible_batch_max
+            if leader:
+                batch = AnsibleBatch()
+                self.batches[batchkey] = batch
+            batch.plays.append(playbook)
 
-    return getresults(resultfile, fieldnames)
+        if not leader:
+            batch.done.wait()
+            return
+
+        try:
+            time.sleep(ansible_batch_window)
+            with self.lock:
+                if self.batches.get(batchkey) is batch:
+                    del self.batches[batchkey]
+
+            logger.debug('running %s batched plays', len(batch.plays))
+            runplaybook(
+                envpath, workdir_,
+                [isolatedplay(play) for play in batch.plays])
+        finally:
+            batch.done.set()
+
+
+ansible_batcher = AnsibleBatcher()
+
+
+def isolatedplay(play):
+    """
+    Gives a play of a batched playbook with its tasks in a block, rescued
+    on failure by removing the play's result file. As all the plays target
+    the same host, a failure left unrescued would have ansible skip the
+    host, and so the plays of the other requests, for the rest of the
+    playbook.
+
+    :type: dict
+    :param play: play of a request
+
+    :rtype: dict
+    :return: the play, isolated
+    """
+
+    isolated = dict(play)
+    isolated['tasks'] = [{
+        'block': play.get('tasks') or [],
+        'rescue': [{
+            'file': {
+                'path': '{{ ' + s_key_resultfile + ' }}',
+                'state': 'absent'}}]}]
+    return isolated
 
 
 def execute_as_python(
-        instanceid, opname, envpath, script, fields, collect, scriptsrc):
+        instanceid, opname, envpath, script, fields, collect, scriptsrc,
+        workdir_=None, scriptkey=None):
 
-    pymod = loaded_code.get(instanceid)
-    logger.debug(pymod)
-    logger.debug(scriptsrc)
-
-    if pymod is None:
-        if scriptsrc == sparkl_services.s_undefined:
-            # dump script to file in "environment" directory
-            scriptsrc = \
-                os.path.join(envpath, s_py_scriptmod + instanceid + '.py')
-            logger.debug(scriptsrc)
-            dst_ = open(scriptsrc, 'w')
-            dst_.writelines(script)
-            dst_.close()
-
-        # dynamically import the script
-        (scriptpath, scriptname) = os.path.split(scriptsrc)
-        (scriptstem, _scriptext) = os.path.splitext(scriptname)
-
-        fp, scriptfile, description = imp.find_module(scriptstem, [scriptpath])
-        pymod = imp.load_module(scriptstem, fp, scriptfile, description)
-        logger.debug(pymod)
-        loaded_code[instanceid] = pymod
+    if python_processes > 0 and scriptsrc == sparkl_services.s_undefined:
+        return execute_in_pool(
+            instanceid, opname, envpath, script, fields, collect, workdir_,
+            scriptkey)
+
+    return run_python(
+        instanceid, opname, envpath, script, fields, collect, scriptsrc,
+        scriptkey)
+
+
+def run_python(
+        instanceid, opname, envpath, script, fields, collect, scriptsrc,
+        scriptkey=None):
+    pymod = load_python(script, scriptsrc, scriptkey)
 
     logger.debug(fields)
     ops = getattr(pymod, s_script_ops)
@@ -269,59 +869,251 @@ def execute_as_python(
     return result
 
 
+def load_python(script, scriptsrc, scriptkey=None):
+    """
+    Gets the module for a python script, from the module cache, which is
+    keyed by a hash of the script source so that identical scripts share
+    a module.
+    """
+
+    if scriptsrc != sparkl_services.s_undefined:
+        # script source is in the given file
+        src_ = open(scriptsrc, 'r')
+        script = src_.read()
+        src_.close()
+        scriptkey = None
+
+    if scriptkey is None:
+        scriptkey = sourcekey(script)
+
+    return loaded_code.get(
+        scriptkey, lambda: import_python(script, scriptkey))
+
+
+def module_cache_stats():
+    """
+    Gives the counters of the python script module cache
+    """
+    return loaded_code.stats()
+
+
+def import_python(script, scriptkey):
+    # compiled in memory, or taken from the bytecode cache, leaving the
+    # module to the module cache rather than sys.modules, so that it is
+    # released once evicted
+    pymod = bytecode.loadmodule(s_py_scriptmod + scriptkey, script, scriptkey)
+    logger.debug(pymod)
+
+    return pymod
+
+
+def execute_in_pool(
+        instanceid, opname, envpath, script, fields, collect, workdir_,
+        scriptkey):
+    """
+    Executes a python script op in the process pool, so that cpu-bound
+    ops are not serialized on the connection process's GIL. The notify
+    events collected by the op are passed on, in order, once it completes,
+    so that the op cannot be told of those dropped where the outbound queue
+    stays full; they are logged, and counted by collect_event.
+    """
+
+    global python_pool
+
+    with python_pool_lock:
+        if python_pool is None:
+            python_pool = newpythonpool()
+        slots = instance_slots.get(instanceid)
+        if slots is None:
+            slots = threading.BoundedSemaphore(python_instance_concurrency)
+            instance_slots[instanceid] = slots
+
+    with slots:
+        result, notifies = python_pool.apply(
+            pool_execute,
+            (instanceid, opname, envpath, script, fields, workdir_,
+             scriptkey))
+
+    dropped = 0
+    for notify_opname, notify_fields in notifies:
+        if collect(notify_opname, notify_fields) is False:
+            dropped += 1
+    if dropped:
+        logger.warning(
+            'dropped %d of %d events collected by %s in the process pool',
+            dropped, len(notifies), opname)
+
+    return result
+
+
+def newpythonpool():
+    """
+    Creates the process pool for python scripts. By the time it is needed,
+    the transport, outbound and log listener threads are running, so its
+    workers are started from a fresh process rather than forked from this
+    one, which would have them inherit those threads' locks and queues.
+    """
+
+    # workers log to the same file, by their own handler
+    initargs = (sparkl_logging.logfile, sparkl_logging.loglevel)
+
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:
+        # python 2, forking being the only start method
+        return multiprocessing.Pool(
+            python_processes, sparkl_logging.resetlogger, initargs)
+
+    methods = multiprocessing.get_all_start_methods()
+    method = 'forkserver' if 'forkserver' in methods else 'spawn'
+    logger.debug('starting %d %s python workers', python_processes, method)
+    return get_context(method).Pool(
+        python_processes, sparkl_logging.resetlogger, initargs)
+
+
+def pool_execute(
+        instanceid, opname, envpath, script, fields, workdir_, scriptkey):
+    """
+    Runs in a pool worker process, with its own loaded_code cache.
+    Returns the op result together with the notify events it collected.
+    """
+
+    notifies = []
+
+    def collect(notify_opname, notify_fields):
+        notifies.append((notify_opname, notify_fields))
+        return True
+
+    context.workdir = workdir_
+    result = run_python(
+        instanceid, opname, envpath, script, fields, collect,
+        sparkl_services.s_undefined, scriptkey)
+    return result, notifies
+
+
 ECLIPSEDOITGOALPREFIX1 = 'do__it :- '
 ECLIPSEDOITGOALPREFIX2 = ' do__it("'
 ECLIPSEDOITGOALSUFFIX1 = '", '
 ECLIPSEDOITGOALSUFFIX2 = ').\n'
+ECLIPSESERVEGOALPREFIX = 'goal('
+ECLIPSESERVEGOALSUFFIX1 = '], '
+ECLIPSESERVEGOALSUFFIX2 = ').\n'
 ECLIPSEPREAMBLETHEORY = 'sparkl_eclipse_clp/preamble.ecl'
 
+eclipsepreamblelines = None
 
-def eclipseaddfields(doitline, fields, fieldnames):
 
-    logger.debug(str(fields))
-    logger.debug(str(fieldnames))
+def eclipsepreamble():
+    """
+    Reads the preamble theory, once
+    """
+
+    global eclipsepreamblelines
 
+    if eclipsepreamblelines is None:
+        preamblefile = os.path.join(
+            __file__.split('__init__.py')[0], '..',
+            ECLIPSEPREAMBLETHEORY)
+        logger.debug(preamblefile)
+
+        preamblefile_ = open(preamblefile, "r")
+        eclipsepreamblelines = preamblefile_.readlines()
+        preamblefile_.close()
+
+    return eclipsepreamblelines
+
+
+def eclipsefieldfacts(fields, fieldnames):
+
+    logger.debug('%s', fields)
+
+    facts = []
     for fieldname in fields.keys():
         (_fieldid, fieldtype) = fieldnames.get(fieldname)
         if fieldtype not in FIELD_TYPES:
             continue
-        logger.debug(fieldname)
         fieldval = fields.get(fieldname)
-        logger.debug(fieldval)
-        logger.debug(fieldtype)
 
-        doitline += 'assert(ecl__field_in('+fieldname+', '
+        fact = 'ecl__field_in('+fieldname+', '
         if fieldtype == "string":
-            doitline += '"'
-        doitline += str(fieldval)
+            fact += '"'
+        fact += str(fieldval)
         if fieldtype == "string":
-            doitline += '"'
-        doitline += ')), '
+            fact += '"'
+        fact += ')'
+        facts.append(fact)
+
+    return facts
+
+
+def eclipseaddfields(doitline, fields, fieldnames):
+
+    for fact in eclipsefieldfacts(fields, fieldnames):
+        doitline += 'assert(' + fact + '), '
 
     return doitline
 
 
-def execute_as_eclipse(
-        opname, envpath, script, fields, fieldnames, resultfile):
+def eclipsepool(script):
+    """
+    Gets the worker pool for an eclipse-clp theory, keyed by its content.
+    A pool is only started for a theory of a live execution plan, by which
+    it is released; there is none, giving None, for any other theory, e.g.
+    that of a plan released whilst a request for it was in flight.
+    """
+
+    key = sourcekey(script)
+
+    with eclipse_pools_lock:
+        pool = eclipse_pools.get(key)
+        if pool is None:
+            with plan_refs_lock:
+                if (release_eclipse, key) not in plan_refs:
+                    return None
+            pool = EclipsePool(
+                eclipse_command, eclipsepreamble(), script, eclipse_workers,
+                eclipse_recycle)
+            eclipse_pools[key] = pool
+
+    return pool
 
-    logger.debug(__file__)
+
+def execute_as_eclipse(
+        opname, envpath, script, fields, fieldnames, resultfile,
+        workdir_=None):
+    return runsteps(eclipse_steps(
+        opname, envpath, script, fields, fieldnames, resultfile, workdir_))
+
+
+def eclipse_steps(
+        opname, envpath, script, fields, fieldnames, resultfile,
+        workdir_=None):
+
+    pool = eclipsepool(script) if eclipse_workers > 0 else None
+    if pool is not None:
+        # feed the goal to a persistent worker, with the theory compiled,
+        # to be run in the working directory of the execution
+        goal = ECLIPSESERVEGOALPREFIX + \
+            '"' + (workdir_ or envpath) + '", [' + \
+            ', '.join(eclipsefieldfacts(fields, fieldnames)) + \
+            ECLIPSESERVEGOALSUFFIX1 + opname.lower() + ECLIPSESERVEGOALSUFFIX2
+        logger.debug(goal)
+
+        result = pool.solve(goal)
+        yield Done(parseresults(result, fieldnames))
+        return
+
+    # have the result written to an in-memory channel if possible, the
+    # result file being the fallback
+    pipe = ResultPipe() if result_pipes else None
+    if pipe is not None:
+        resultfile = pipe.path
 
     # dump eclipse script file in "environment" directory
     eclipsefile = os.path.join(envpath, s_value_eclipsefile)
     dst_ = open(eclipsefile, 'w')
 
     eclipsefilelines = []
-
-    preamblefile = os.path.join(
-        __file__.split('__init__.py')[0], '..',
-        ECLIPSEPREAMBLETHEORY)
-    logger.debug(preamblefile)
-
-    preamblefile_ = open(preamblefile, "r")
-    preamblelines = preamblefile_.readlines()
-    preamblefile_.close()
-
-    eclipsefilelines.extend(preamblelines)
+    eclipsefilelines.extend(eclipsepreamble())
 
     doitline = eclipseaddfields(ECLIPSEDOITGOALPREFIX1, fields, fieldnames) +\
         ECLIPSEDOITGOALPREFIX2 + resultfile + ECLIPSEDOITGOALSUFFIX1 +\
@@ -334,13 +1126,26 @@ def execute_as_eclipse(
     eclipsefilelines.extend([script])
     logger.debug(eclipsefilelines)
 
-    dst_.writelines(eclipsefilelines)
-    dst_.close()
+    try:
+        dst_.writelines(eclipsefilelines)
+        dst_.close()
+    except IOError:
+        if pipe is not None:
+            pipe.close()
+        raise
 
     # run eclipse
-    eclipsecmd = "eclipse -f " + eclipsefile + " -e do__it"
+    eclipsecmd = eclipse_command + " -f " + eclipsefile + " -e do__it"
     logger.debug(eclipsecmd)
-    call(eclipsecmd.split(" "))
+    try:
+        result = yield Command(eclipsecmd.split(" "), workdir_, pipe=pipe)
+    finally:
+        # where the command was not run after all
+        if pipe is not None:
+            pipe.close()
     logger.debug("done executing eclipse script")
 
-    return getresults(resultfile, fieldnames)
+    if pipe is not None:
+        yield Done(parseresults(result, fieldnames))
+    else:
+        yield Done(getresults(resultfile, fieldnames))
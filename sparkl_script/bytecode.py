@@ -0,0 +1,162 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Compiles python scripts from source in memory, keeping their code objects
+in an on-disk marshal cache keyed by source hash and interpreter version,
+so that cold starts and new service instances skip compilation. A cached
+code object is removed once no live service instance uses its script, so
+that the cache holds the scripts in use rather than every one ever run.
+"""
+
+import linecache
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import types
+
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
+
+logger = logging.getLogger(__name__)
+
+# directory of the code object cache - no caching where set empty
+cachedir = os.environ.get(
+    'SPARKL_PY_BYTECODE_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'sparkl_script'))
+
+# interpreter version, as distinguishing cached code objects
+cachetag = getattr(
+    getattr(sys, 'implementation', None), 'cache_tag', None) or \
+    'py%d%d' % sys.version_info[:2]
+
+s_cache_suffix = '.code'
+
+
+def cachefile(key):
+    return os.path.join(cachedir, key + '.' + cachetag + s_cache_suffix)
+
+
+def getcode(source, key, filename):
+    """
+    Gets the code object for a script source, from the cache if there,
+    otherwise compiling it and adding it to the cache
+
+    :type: str
+    :param source: script source
+
+    :type: str
+    :param key: key of the script source, as given by sourcekey
+
+    :type: str
+    :param filename: file name the code is reported under
+    """
+
+    if cachedir:
+        code = readcode(cachefile(key))
+        if code is not None and code.co_filename == filename:
+            return code
+
+    code = compile(source, filename, 'exec')
+
+    if cachedir:
+        writecode(cachefile(key), code)
+
+    return code
+
+
+def discard(key):
+    """
+    Removes the cached code object for a script source, if any
+
+    :type: str
+    :param key: key of the script source, as given by sourcekey
+    """
+
+    if not cachedir:
+        return
+
+    try:
+        os.unlink(cachefile(key))
+    except (IOError, OSError):
+        pass
+
+
+def readcode(path):
+    try:
+        src_ = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+
+    try:
+        if src_.read(len(MAGIC_NUMBER)) != MAGIC_NUMBER:
+            return None
+        return marshal.load(src_)
+    except (EOFError, ValueError, TypeError) as e:
+        logger.warning('bad cached code %s: %s', path, e)
+        return None
+    finally:
+        src_.close()
+
+
+def writecode(path, code):
+    # written to a temporary file and renamed into place, so that readers
+    # (in this or another process) never see a partly written file
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        fd, tmppath = tempfile.mkstemp(dir=cachedir)
+        dst_ = os.fdopen(fd, 'wb')
+        try:
+            dst_.write(MAGIC_NUMBER)
+            marshal.dump(code, dst_)
+        finally:
+            dst_.close()
+        os.rename(tmppath, path)
+    except (IOError, OSError) as e:
+        logger.warning('cannot cache code %s: %s', path, e)
+
+
+def loadmodule(name, source, key):
+    """
+    Creates a module from a script source, without it being written out
+    or registered in sys.modules
+
+    :type: str
+    :param name: module name
+
+    :type: str
+    :param source: script source
+
+    :type: str
+    :param key: key of the script source, as given by sourcekey
+
+    :return: the module
+    """
+
+    filename = '<' + name + '>'
+    code = getcode(source, key, filename)
+
+    # lets tracebacks show the script's lines
+    lines = source.splitlines(True)
+    linecache.cache[filename] = (len(source), None, lines, filename)
+
+    pymod = types.ModuleType(name)
+    pymod.__file__ = filename
+    exec(code, pymod.__dict__)
+    return pymod
+
+
+def unloadmodule(name):
+    """
+    Drops what loadmodule registered for a module, once it is no longer
+    used
+
+    :type: str
+    :param name: module name
+    """
+    linecache.cache.pop('<' + name + '>', None)
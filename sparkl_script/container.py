@@ -23,9 +23,13 @@ sys.path.extend(ext_root_dirs)
 
 from sparkl_logging import setlogger
 from sparkl_services import (
-    ws
+    ws,
+    batch
 )
 
+# websocket transport, 'aio' selecting the asyncio based one
+transport = os.environ.get('SPARKL_TRANSPORT', 'ws')
+
 now = str((datetime.utcnow() - datetime(1970, 1, 1)).total_seconds())
 
 if __name__ == '__main__':
@@ -44,9 +48,22 @@ if __name__ == '__main__':
     encoding = 'json'
 
     url_ws = \
-        host+":"+port+"/"+url_stub+"_ws/connect?pending="+processid+"&encoding="+encoding
+        host+":"+port+"/"+url_stub+"_ws/connect?pending="+processid + \
+        "&encoding="+encoding+batch.urlparams()
 
     logger.debug(url_ws)
 
     logger.debug("create and open the websocket for comms")
-    ws.start(url_ws, args)
+    if transport == 'aio':
+        # the asyncio transport needs the websockets package, which the
+        # default one does not
+        try:
+            from sparkl_services import aio
+        except ImportError as e:
+            logger.error(e)
+            sys.exit(
+                'SPARKL_TRANSPORT=aio needs the websockets package: ' +
+                str(e))
+        aio.start(url_ws, args)
+    else:
+        ws.start(url_ws, args)
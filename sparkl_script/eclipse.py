@@ -0,0 +1,172 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Pool of long-lived eclipse-clp processes, each having compiled the SPARKL
+preamble and a service instance's theory once, and serving goals fed to it
+over a pipe.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from subprocess import Popen, PIPE
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+s_theoryfile = 'theory.ecl'
+s_serve_goal = 'serve__'
+s_result_prefix = 'ecl__result:'
+
+# left in the idle workers of a closed pool, for any goal waiting on one
+s_closed = object()
+
+
+class EclipseWorker(object):
+    """
+    An eclipse-clp process, running the preamble's serve__ loop over
+    a compiled theory.
+    """
+
+    def __init__(self, command, theoryfile):
+        self.goals = 0
+        self.process = Popen(
+            [command, '-f', theoryfile, '-e', s_serve_goal],
+            stdin=PIPE,
+            stdout=PIPE,
+            universal_newlines=True)
+
+    def solve(self, goal):
+        """
+        Feeds a goal to the process and reads back its result.
+
+        :type: str
+        :param goal: goal(Dir, Facts, Goal) term, terminated with a full stop
+
+        :rtype: str
+        :return: JSON result written by the goal, or None where it failed
+        """
+
+        self.goals += 1
+        self.process.stdin.write(goal)
+        self.process.stdin.flush()
+
+        # anything written to output by the theory itself is passed over
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise IOError('eclipse worker exited')
+            if line.startswith(s_result_prefix):
+                return line[len(s_result_prefix):].strip() or None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class EclipsePool(object):
+    """
+    Bounded pool of eclipse-clp workers for a theory. Workers are started
+    on demand, and are recycled once they have served a given number of
+    goals.
+    """
+
+    def __init__(self, command, preamblelines, script, size, recycle):
+        self.command = command
+        self.recycle = recycle
+        self.theorypath = tempfile.mkdtemp(prefix='sparkl_eclipse_')
+        self.theoryfile = os.path.join(self.theorypath, s_theoryfile)
+
+        dst_ = open(self.theoryfile, 'w')
+        dst_.writelines(preamblelines)
+        dst_.writelines([script])
+        dst_.close()
+
+        # idle workers, None standing for one not yet started
+        self.workers = queue.LifoQueue()
+        for _ in range(size):
+            self.workers.put(None)
+
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def solve(self, goal):
+        """
+        Solves a goal on an idle worker, waiting for one if necessary.
+
+        :type: str
+        :param goal: goal(Dir, Facts, Goal) term, terminated with a full stop
+
+        :rtype: str
+        :return: JSON result written by the goal, or None where it failed
+        """
+
+        worker = self.workers.get()
+        if worker is s_closed:
+            self.workers.put(worker)
+            raise IOError('eclipse pool closed')
+
+        try:
+            if worker is None:
+                worker = EclipseWorker(self.command, self.theoryfile)
+            result = worker.solve(goal)
+        except Exception:
+            if worker is not None:
+                worker.close()
+            self.giveback(None)
+            raise
+
+        if worker.goals >= self.recycle:
+            worker.close()
+            worker = None
+        self.giveback(worker)
+
+        logger.debug(result)
+        return result
+
+    def giveback(self, worker):
+        """
+        Returns a worker, or None for one to be started, to the idle
+        workers, unless the pool is closed, in which case it is stopped
+        """
+
+        with self.lock:
+            if not self.closed:
+                self.workers.put(worker)
+                return
+
+        if worker is not None:
+            worker.close()
+
+    def close(self):
+        """
+        Stops the idle workers and removes the theory; busy workers are
+        stopped as they are returned, and goals failed from then on.
+        """
+
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+
+        while True:
+            try:
+                worker = self.workers.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.close()
+
+        self.workers.put(s_closed)
+        shutil.rmtree(self.theorypath, ignore_errors=True)
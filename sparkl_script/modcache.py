@@ -0,0 +1,122 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Bounded cache of loaded python script modules, keyed by a hash of their
+source, so that identical scripts share a module and changed scripts are
+loaded afresh.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def sourcekey(source):
+    """
+    Gives the cache key for a script source
+
+    :type: str
+    :param source: script source
+    """
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+class ModuleCache(object):
+    """
+    Least recently used cache of loaded script modules, holding at most
+    maxsize modules, with hit/miss/eviction counters. The release function,
+    if any, is called with the key of each module evicted or discarded.
+    """
+
+    def __init__(self, maxsize, release=None):
+        self.maxsize = maxsize
+        self.release = release
+        self.modules = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """
+        Gets the module for a key, loading it on a miss
+
+        :type: str
+        :param key: key of the script source, as given by sourcekey
+
+        :type: func
+        :param load: function of no arguments loading the module
+
+        :return: the loaded module
+        """
+
+        with self.lock:
+            pymod = self.modules.pop(key, None)
+            if pymod is not None:
+                self.modules[key] = pymod
+                self.hits += 1
+                return pymod
+            self.misses += 1
+
+        # loaded outside of the lock, so that hits are not held up by it;
+        # where another thread loads the same script meanwhile, the first
+        # module loaded is kept
+        pymod = load()
+        logger.debug('loaded module for %s', key)
+
+        with self.lock:
+            existing = self.modules.get(key)
+            if existing is not None:
+                return existing
+
+            self.modules[key] = pymod
+            evicted = []
+            while len(self.modules) > self.maxsize:
+                evictedkey, _ = self.modules.popitem(last=False)
+                self.evictions += 1
+                evicted.append(evictedkey)
+                logger.debug('evicted module for %s', evictedkey)
+
+        for evictedkey in evicted:
+            self.released(evictedkey)
+
+        return pymod
+
+    def discard(self, key):
+        """
+        Drops the module for a key, if loaded
+
+        :type: str
+        :param key: key of the script source, as given by sourcekey
+        """
+
+        with self.lock:
+            pymod = self.modules.pop(key, None)
+
+        if pymod is not None:
+            logger.debug('discarded module for %s', key)
+            self.released(key)
+
+    def released(self, key):
+        if self.release is not None:
+            self.release(key)
+
+    def stats(self):
+        """
+        Gives the cache counters
+
+        :rtype: dict
+        :return: size, maxsize, hits, misses and evictions
+        """
+
+        with self.lock:
+            return {
+                'size': len(self.modules),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,217 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Pool of reusable scratch "environment" directories for script execution.
+Prop files are materialized once for any given set of props, and copied
+into a scratch environment, so that between requests only the artifacts
+of the request itself need to be cleaned up. Each environment has its own
+copies, which a script may change, those changed being copied afresh.
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+s_props_dir = 'props'
+s_env_prefix = 'env'
+
+
+def propskey(props):
+    """
+    Gives the key under which a set of prop files is materialized
+
+    :type: list
+    :param props: (file name, file content) pairs
+    """
+
+    digest = hashlib.sha1()
+    for name, value in props:
+        digest.update(name.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(value.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ScratchEnv(object):
+    """
+    A scratch environment directory, with its script sub-directory
+    holding copies of the prop files of the current request.
+    """
+
+    def __init__(self, path, subdirname, resultfilename):
+        self.path = path
+        self.subdir = os.path.join(path, subdirname)
+        self.resultfile = os.path.join(path, resultfilename)
+        self.propskey = None
+
+        # prop file name to (path, signature) of its copy
+        self.files = {}
+        os.makedirs(self.subdir)
+
+
+class ScratchPool(object):
+    """
+    Pool of scratch environments under a root directory, one being in use
+    by each request being executed at the time.
+    """
+
+    def __init__(self, root, subdirname, resultfilename):
+        self.subdirname = subdirname
+        self.resultfilename = resultfilename
+        self.path = tempfile.mkdtemp(prefix='sparkl_scratch_', dir=root)
+        self.propspath = os.path.join(self.path, s_props_dir)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.count = 0
+        self.materialized = set()
+
+        os.makedirs(self.propspath)
+        atexit.register(shutil.rmtree, self.path, True)
+
+    def acquire(self, props, key):
+        """
+        Gets a clean scratch environment, with the given prop files copied
+        into its script sub-directory
+
+        :type: list
+        :param props: (file name, file content) pairs
+
+        :type: str
+        :param key: key of the props, as given by propskey
+
+        :rtype: ScratchEnv
+        :return: the scratch environment
+        """
+
+        with self.lock:
+            if self.idle:
+                env = self.idle.pop()
+            else:
+                self.count += 1
+                env = None
+                envpath = os.path.join(
+                    self.path, s_env_prefix + str(self.count))
+
+        if env is None:
+            env = ScratchEnv(envpath, self.subdirname, self.resultfilename)
+            logger.debug('new scratch env %s', env.path)
+
+        # props forgotten while the env was in use are materialized afresh
+        if env.propskey != key or key not in self.materialized:
+            self.copy(env, props, key)
+
+        return env
+
+    def release(self, env):
+        """
+        Cleans up the artifacts of a request from a scratch environment,
+        and returns it to the pool
+        """
+
+        try:
+            self.clean(env)
+        except OSError as e:
+            logger.error(e)
+            shutil.rmtree(env.path, True)
+            return
+
+        with self.lock:
+            self.idle.append(env)
+
+    def copy(self, env, props, key):
+        materialpath = self.materialize(props, key)
+        uncopy(env)
+
+        for name, _value in props:
+            path = os.path.join(env.subdir, name)
+            shutil.copyfile(os.path.join(materialpath, name), path)
+            env.files[name] = path, signature(path)
+        env.propskey = key
+
+    def materialize(self, props, key):
+        """
+        Writes a set of prop files, read-only, if not already written
+        """
+
+        materialpath = os.path.join(self.propspath, key)
+
+        with self.lock:
+            if key not in self.materialized:
+                os.makedirs(materialpath)
+                for name, value in props:
+                    prop_file = os.path.join(materialpath, name)
+                    dst_ = open(prop_file, 'w')
+                    dst_.writelines(value)
+                    dst_.close()
+                    os.chmod(
+                        prop_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                self.materialized.add(key)
+
+        return materialpath
+
+    def forget(self, key):
+        """
+        Removes a set of prop files, once no longer used, together with
+        their copies in the idle environments; one in use keeps its copies,
+        which are materialized afresh on its next acquire
+        """
+
+        with self.lock:
+            if key not in self.materialized:
+                return
+            self.materialized.discard(key)
+
+            for env in self.idle:
+                if env.propskey == key:
+                    uncopy(env)
+                    env.propskey = None
+
+        shutil.rmtree(os.path.join(self.propspath, key), True)
+
+    def clean(self, env):
+        for name in os.listdir(env.path):
+            if name != self.subdirname:
+                remove(os.path.join(env.path, name))
+
+        # a prop file changed, removed or replaced by the script is copied
+        # afresh on the next acquire
+        for name in os.listdir(env.subdir):
+            path = os.path.join(env.subdir, name)
+            if name in env.files and signature(path) == env.files[name][1]:
+                continue
+            remove(path)
+            env.propskey = None
+
+        for path, _signature in env.files.values():
+            if not os.path.lexists(path):
+                env.propskey = None
+
+
+def uncopy(env):
+    for path, _signature in env.files.values():
+        if os.path.lexists(path):
+            os.unlink(path)
+    env.files = {}
+
+
+def signature(path):
+    """
+    Gives what changes with the content of a file, or its replacement
+    """
+    st = os.lstat(path)
+    return st.st_ino, st.st_mode, st.st_size, st.st_mtime
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
@@ -7,8 +7,11 @@ particular events and then proceeds to start the service.
 """
 
 import logging
-import json
-from sparkl_script import executeresults, execute_as_python
+import os
+import threading
+import time
+import sparkl_script
+from sparkl_services import codec, metrics, profiling
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,10 @@ callbacks = {}
 # handle for comms
 handle = None
 
+# script runs from concurrent transport workers are serialized, unless
+# the script engine declares itself thread safe
+script_lock = threading.Lock()
+
 s_undefined = "undefined"
 
 # service related string literals
@@ -33,25 +40,33 @@ s_script_src = 'script.src'
 s_envsdir = "envs"
 ##
 
-# meta-data state
-s_md_optags = "optags"
-s_md_opreplies = "opreplies"
-s_md_opids = "opids"
-s_md_opnames = "opnames"
-s_md_fieldids = "fieldids"
-s_md_fieldnames = "fieldnames"
-s_md_props = "props"
-s_md_type = s_type
+# meta-data state, as a ServiceDescriptor per instance id
 metadata = {
 }
 ##
 
+# instance eviction - seconds after which an instance without events is torn
+# down, and maximum number of instances kept, the least recently used being
+# torn down first; 0 for no limit
+instance_idle = float(os.environ.get('SPARKL_INSTANCE_IDLE', 0))
+instance_max = int(os.environ.get('SPARKL_INSTANCE_MAX', 0))
+
+# guards the events in flight against each instance, which are admitted on
+# the transport reader thread and settled on its workers, against teardown
+instance_lock = threading.Lock()
+
 # event types
 et_open = 'open_event'
 et_aggevent = 'aggregate_event'
+et_close = 'close_event'
 et_dataevent = 'data_event'
 et_errorevent = 'error_event'
 et_internal = 'internal'
+et_profile = 'profile'
+
+# events changing the instances later events are handled against, which
+# transports handling events concurrently handle in order on their reader
+ordered_events = (et_open, et_aggevent, et_close)
 ##
 
 # event record strings
@@ -110,32 +125,89 @@ def register_eventcallback(eventtype, callback):
     :param callback: the function to call back in receipt of an event of the
     given type
     """
-    logger.debug('registering callback ' + str(callback) + ' for '+eventtype)
+    logger.debug('registering callback %s for %s', callback, eventtype)
     callbacks[eventtype] = callback
 
 
 def handle_msg(msg_, envpath):
     """
-    Handles JSON message received on message transport.
-    Returns a tuple indicating success and a yielded reply.
+    Handles JSON message received on message transport, being an event or,
+    where batched, an array of events.
+    Returns the yielded reply, or for an array, the list of yielded replies.
 
     :type: str
     :param msg_: Message received.
 
-    :rtype: bool, dict
-    :return: whether success and yielded reply
+    :rtype: dict or list
+    :return: yielded reply, or replies
 
     :type: str
     :param envpath: location of instance env directory
     """
 
-    msg = str(msg_)
-    logger.debug(msg)
+    msg_dict = decode_msg(msg_)
+    if not isinstance(msg_dict, list):
+        return handle_event(msg_dict, envpath)
+
+    replies = []
+    for event in msg_dict:
+        reply = handle_event(event, envpath)
+        if reply is not None:
+            replies.append(reply)
+    return replies
+
+
+def decode_msg(msg_):
+    """
+    Decodes JSON message received on message transport into an event dict,
+    or a list of them where the frame is batched.
+
+    :type: str
+    :param msg_: Message received, as str or bytes.
+
+    :rtype: dict or list
+    :return: decoded event, or events
+    """
+
+    logger.debug(msg_)
 
     # convert JSON message to dict
-    msg_dict = json.loads(msg)
-    logger.debug(msg_dict)
-    logger.debug(type(msg_dict))
+    since = metrics.now()
+    msg_dict = codec.loads(msg_)
+    metrics.observe(metrics.s_decode, since)
+    return msg_dict
+
+
+def encode_msg(event):
+    """
+    Encodes an event dict into a JSON message for the message transport.
+
+    :type: dict
+    :param event: event to send
+
+    :rtype: str
+    :return: encoded event
+    """
+
+    since = metrics.now()
+    msg_ = codec.dumps(event)
+    metrics.observe(metrics.s_encode, since)
+    return msg_
+
+
+def handle_event(msg_dict, envpath):
+    """
+    Handles a decoded event, as produced by decode_msg.
+
+    :type: dict
+    :param msg_dict: decoded event
+
+    :type: str
+    :param envpath: location of instance env directory
+
+    :rtype: dict
+    :return: yielded reply, if any
+    """
 
     # extract tag, attrs, and content - according to SPARKL serialization
     # schema
@@ -143,27 +215,95 @@ def handle_msg(msg_, envpath):
     eventattrs = msg_dict.get(s_attributes, [])
     eventcontent = msg_dict.get(s_content, [])
 
-    logger.debug(eventtag)
-    logger.debug(str(eventattrs))
-    logger.debug(str(eventcontent))
-
     # extract instanceid
     instanceid = eventattrs.get(s_instanceid)
-    logger.debug(str(instanceid))
-
     eventid = eventattrs.get(s_id)
-    logger.debug(eventid)
-
     subject = eventattrs.get(s_subject)
-    logger.debug(subject)
-    logger.debug(eventtag)
+
+    logger.debug('%s %s %s', eventtag, eventattrs, eventcontent)
 
     try:
         return handle_msg_(
             instanceid, eventid, eventtag, eventattrs, eventcontent, envpath)
     except Exception as e:
-        logger.error(e)
-        return serialize_error_event(eventid, subject, "'"+e.message+"'")
+        return error_reply(e, instanceid, eventid, subject)
+
+
+def handle_event_steps(msg_dict, envpath):
+    """
+    Handles a decoded event, as handle_event does, in steps: yields the
+    processes to be run on its behalf, as sparkl_script Commands, each being
+    sent back its outcome, and lastly the yielded reply, as Done.
+    Only the script executions of request and one-way events are taken in
+    steps, any other event being handled in line by the first step.
+
+    :type: dict
+    :param msg_dict: decoded event
+
+    :type: str
+    :param envpath: location of instance env directory
+    """
+
+    eventtag = str(msg_dict.get(s_tag))
+    eventattrs = msg_dict.get(s_attributes, [])
+    instanceid = eventattrs.get(s_instanceid)
+    subject = eventattrs.get(s_subject)
+
+    service = metadata.get(instanceid)
+    op = service.ops.get(subject) if service is not None else None
+    plan = service.plans.get(op.id) if op is not None else None
+
+    if eventtag != et_dataevent or plan is None or \
+            op.tag not in (s_op_rr, s_op_co, s_op_ow) or \
+            not sparkl_script.threadsafe or \
+            profiling.profiled(instanceid, op.name):
+        yield sparkl_script.Done(handle_event(msg_dict, envpath))
+        return
+
+    eventid = eventattrs.get(s_id)
+    eventcontent = msg_dict.get(s_content, [])
+
+    try:
+        service, op = lookup(instanceid, eventattrs)
+        fields_ = request_fields(service, op, eventcontent)
+        fields, fieldnames = fields_
+
+        since = metrics.now()
+        steps = sparkl_script.executeplan_steps(
+            plan, fields, fieldnames, new_collect(instanceid), envpath)
+        step = next(steps)
+        while not isinstance(step, sparkl_script.Done):
+            try:
+                outcome = yield step
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(outcome)
+        metrics.observe(
+            metrics.s_execute, since, instanceid, op.name, plan.language)
+
+        reply = None
+        if op.tag != s_op_ow:
+            reply = request_reply(
+                service, op, eventid, eventattrs, fields_, step.result)
+    except Exception as e:
+        reply = error_reply(e, instanceid, eventid, subject)
+
+    yield sparkl_script.Done(reply)
+
+
+def error_reply(e, instanceid, eventid, subject):
+    """
+    Gives the error event replying to an event whose handling failed
+    """
+
+    logger.error(e)
+
+    # counted against the op name, as are all metrics
+    service = metadata.get(instanceid)
+    op = service.ops.get(subject) if service is not None else None
+    metrics.count('errors', instanceid, op.name if op else None)
+    return serialize_error_event(eventid, subject, "'"+str(e)+"'")
 
 
 def handle_msg_(
@@ -173,34 +313,159 @@ def handle_msg_(
         handle_metadata(instanceid, eventcontent)
         return None
 
+    elif eventtag == et_aggevent or eventtag == et_close:
+        teardown(instanceid)
+        return None
+
+    elif eventtag == et_profile:
+        profiling.control(eventattrs)
+        return None
+
     elif eventtag == et_dataevent:
-        subject = eventattrs.get(s_subject)
-        ev_type = metadata.get(instanceid).get(s_md_optags).get(subject)
+        service, op = lookup(instanceid, eventattrs)
+        ev_type = op.tag if op else None
         logger.debug(ev_type)
 
         if ev_type == s_op_rr or ev_type == s_op_co:
             reply = handle_request(
-                instanceid, eventid, eventattrs, eventcontent, envpath)
-            logger.debug(str(reply))
+                service, op, eventid, eventattrs, eventcontent, envpath)
+            logger.debug('%s', reply)
             return reply
 
         elif ev_type == s_op_ow:
-            reply = handle_oneway(instanceid, eventattrs, eventcontent, envpath)
-            logger.debug(str(reply))
+            reply = handle_oneway(service, op, eventcontent, envpath)
+            logger.debug('%s', reply)
             return reply
 
         elif ev_type == s_op_re:
-            reply = handle_response(instanceid, eventcontent)
-            logger.debug(str(reply))
+            reply = handle_response(service, eventcontent)
+            logger.debug('%s', reply)
             return reply
 
-    logger.debug("ignoring "+eventtag)
+    logger.debug('ignoring %s', eventtag)
     return None
 
 
+def lookup(instanceid, eventattrs):
+    """
+    Looks up the service instance and op a data event is for
+
+    :rtype: ServiceDescriptor, OpDescriptor
+    :return: the instance, and the op, or None where unknown
+    """
+
+    since = metrics.now()
+    service = metadata.get(instanceid)
+    if service is None or \
+            service.closing and eventattrs.get(s_id) not in service.inflight:
+        # never opened, or torn down since
+        raise ValueError('unknown service instance ' + str(instanceid))
+    service.lastused = time.time()
+    op = service.ops.get(eventattrs.get(s_subject))
+
+    opname = op.name if op else None
+    metrics.observe(metrics.s_lookup, since, instanceid, opname)
+    metrics.count('events', instanceid, opname)
+
+    return service, op
+
+
+class ServiceDescriptor(object):
+    """
+    Compiled meta-data for a service instance, built from its open events,
+    so that handling a data event needs a single lookup in metadata.
+    """
+
+    __slots__ = (
+        'instanceid', 'type', 'ops', 'opnames', 'fieldids', 'fieldnames',
+        'props', 'propfields', 'allfieldnames', 'plans', 'lastused',
+        'inflight', 'closing', 'retired')
+
+    def __init__(self, instanceid):
+        self.instanceid = instanceid
+        self.type = None
+
+        # time of the last event for the instance, for eviction
+        self.lastused = time.time()
+
+        # ids of the data events admitted and not yet settled, and whether
+        # the instance is to be torn down once they are
+        self.inflight = set()
+        self.closing = False
+
+        # plans dropped whilst events were in flight, each with the ids of
+        # the events they wait on before being released
+        self.retired = []
+
+        # op id to OpDescriptor
+        self.ops = {}
+
+        # op name to op id, for all but response ops
+        self.opnames = {}
+
+        # field id to field name
+        self.fieldids = {}
+
+        # field name to (field id, field type)
+        self.fieldnames = {}
+
+        # prop name to (prop value, prop type)
+        self.props = {}
+
+        # props as field *name*/value pairs, overlaid on request fields
+        self.propfields = {}
+
+        # fieldnames, plus (None, prop type) for each prop field
+        self.allfieldnames = {}
+
+        # op id to ExecutionPlan, for script services
+        self.plans = {}
+
+    def __repr__(self):
+        return 'ServiceDescriptor(' + str(self.instanceid) + ', ' + \
+            str(self.type) + ', ' + str(self.ops) + ', ' + \
+            str(self.fieldnames) + ', ' + str(self.props) + ')'
+
+
+class OpDescriptor(object):
+    """
+    Compiled meta-data for an operation of a service instance.
+    """
+
+    __slots__ = ('id', 'name', 'tag', 'replies', 'section')
+
+    def __init__(self, opid, name, tag, replies, section=None):
+        self.id = opid
+        self.name = name
+        self.tag = tag
+
+        # reply name to reply op id, for request and consume ops
+        self.replies = replies
+
+        # tag of the meta-data section listing the op
+        self.section = section
+
+    def __eq__(self, other):
+        return isinstance(other, OpDescriptor) and \
+            self.id == other.id and self.name == other.name and \
+            self.tag == other.tag and self.replies == other.replies and \
+            self.section == other.section
+
+    def __repr__(self):
+        return 'OpDescriptor(' + str(self.name) + ', ' + str(self.tag) + \
+            ', ' + str(self.replies) + ')'
+
+
 def handle_metadata(instanceid, eventcontent):
     """
-    Handles the metadata by writing it to metadata dict
+    Handles the metadata by compiling it into the instance's
+    ServiceDescriptor in the metadata dict.
+    Each op section, the fields, and the service props and provision present
+    in the event give the whole of that part of the meta-data, replacing what
+    was there, so that changed entries are updated and entries no longer
+    listed are removed; parts not present are kept as they are. Only the prop
+    fields and execution plans affected by the changes are rebuilt, the plans
+    dropped being released once the events in flight are settled.
 
     :type: str
     :param instanceid: id of the pertaining service instance
@@ -209,39 +474,25 @@ def handle_metadata(instanceid, eventcontent):
     :param eventcontent: content of the received open/agg event
     """
 
-    opreplies = {}
-    optags = {}
-    opids = {}
-    opnames = {}
-    fieldids = {}
-    fieldnames = {}
-    props = {}
-
     service = metadata.get(instanceid)
 
     # do we have meta data already for this service
     if service is None:
-        # no meta data yet for service, so create some
-        service = {
-            s_md_opreplies: opreplies,
-            s_md_optags: optags,
-            s_md_opids: opids,
-            s_md_opnames: opnames,
-            s_md_fieldids: fieldids,
-            s_md_fieldnames: fieldnames,
-            s_md_props: props
-        }
+        # no meta data yet for service, so make room and create some
+        evict(time.time())
+        service = ServiceDescriptor(instanceid)
         metadata[instanceid] = service
-
-    else:
-        # yes we do have meta data already, so use it as a basis
-        opreplies = service.get(s_md_opreplies)
-        optags = service.get(s_md_optags)
-        opids = service.get(s_md_opids)
-        opnames = service.get(s_md_opnames)
-        fieldids = service.get(s_md_fieldids)
-        fieldnames = service.get(s_md_fieldnames)
-        props = service.get(s_md_props)
+    elif service.closing:
+        # opened again before the events in flight were settled
+        with instance_lock:
+            service.closing = False
+
+    # parts of the meta-data given by the event, None where not given
+    sections = {}
+    fieldids = None
+    fieldnames = None
+    props = None
+    servicetype = None
 
     for item in eventcontent:
         # for every piece of meta data, get its tag
@@ -256,6 +507,9 @@ def handle_metadata(instanceid, eventcontent):
                 or itemtag == s_op_cos or itemtag == s_op_nos \
                 or itemtag == s_op_res:
 
+            section = itemtag
+            sectionops = sections.setdefault(section, {})
+
             ops = item.get(s_content, [])
             if ops:
                 for op in ops:
@@ -263,28 +517,30 @@ def handle_metadata(instanceid, eventcontent):
                     itemtag = op.get(s_tag)
                     itemid = attrs.get(s_id)
                     itemname = attrs.get(s_name)
-                    logger.debug('adding op...'+itemid+":"+itemname)
-                    opids[itemid] = itemname
-                    if not itemtag == s_op_re:
-                        opnames[itemname] = itemid
-                    optags[itemid] = itemtag
+                    logger.debug('adding op...%s:%s', itemid, itemname)
+                    reply_md = None
                     if itemtag == s_op_co and op.get(s_content) is None:
-                        optags[itemid] = s_op_ow
+                        itemtag = s_op_ow
                     elif itemtag == s_op_co or itemtag == s_op_rr:
                         replies = op.get(s_content, [])
                         reply_md = {}
-                        opreplies[itemid] = reply_md
                         for reply in replies:
                             attrs = reply.get(s_attributes, [])
                             replyid = attrs.get(s_id)
                             replyname = attrs.get(s_name)
                             reply_md[replyname] = replyid
+                    sectionops[itemid] = OpDescriptor(
+                        itemid, itemname, itemtag, reply_md, section)
 
         elif itemtag == s_fieldstag:
 
             # if a field, gets its id to go along with name, and add
             # to respective field dicts
 
+            if fieldids is None:
+                fieldids = {}
+                fieldnames = {}
+
             fields = item.get(s_content, [])
             for field in fields:
                 attrs = field.get(s_attributes, [])
@@ -294,7 +550,7 @@ def handle_metadata(instanceid, eventcontent):
                 if itemtype:
                     itemname = attrs.get(s_name)
                     itemid = attrs.get(s_id)
-                    logger.debug('adding field...'+itemid+":"+itemname)
+                    logger.debug('adding field...%s:%s', itemid, itemname)
                     fieldids[itemid] = itemname
                     fieldnames[itemname] = (itemid, itemtype)
 
@@ -306,8 +562,8 @@ def handle_metadata(instanceid, eventcontent):
             servicetype = serviceattrs.get(s_provision)
             logger.debug(servicetype)
 
-            if service.get(s_md_type) is None:
-                service[s_md_type] = servicetype
+            if props is None:
+                props = {}
 
             servicecontent = item.get(s_content, [])
             for serviceitem in servicecontent:
@@ -323,17 +579,274 @@ def handle_metadata(instanceid, eventcontent):
                     logger.debug(propvalue)
                     props[propname] = (propvalue, proptype)
 
-    logger.debug(str(service))
+    # the changed parts are replaced rather than updated, as in-flight
+    # requests may be reading them
+    opschanged = False
+    if sections:
+        ops = dict(
+            (opid, op) for opid, op in service.ops.items()
+            if op.section not in sections)
+        for sectionops in sections.values():
+            ops.update(sectionops)
+
+        if ops != service.ops:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    'ops of %s: %d added, %d removed', instanceid,
+                    len(set(ops) - set(service.ops)),
+                    len(set(service.ops) - set(ops)))
+            service.opnames = dict(
+                (op.name, opid) for opid, op in ops.items()
+                if op.tag != s_op_re)
+            service.ops = ops
+            opschanged = True
+
+    fieldschanged = \
+        fieldnames is not None and fieldnames != service.fieldnames
+    if fieldschanged:
+        service.fieldids = fieldids
+        service.fieldnames = fieldnames
+
+    propschanged = props is not None and props != service.props
+    if propschanged:
+        service.props = props
+
+    # a changed provision changes how the instance's events are handled
+    typechanged = \
+        servicetype is not None and servicetype != service.type
+    if typechanged:
+        service.type = servicetype
+
+    service.lastused = time.time()
+
+    # the prop fields depend on the fields and props, and the execution
+    # plans on the ops, props and provision
+    if fieldschanged or propschanged or typechanged:
+        compile_props(service)
+    if opschanged or propschanged or typechanged:
+        compile_plans(service)
+
+    logger.debug('%s', service)
+
+
+def compile_props(service):
+    """
+    Builds the prop fields of a service instance, which are overlaid on the
+    fields of every incoming event, and the field meta-data including them
+
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
+    """
+
+    propfields = {}
+    allfieldnames = dict(service.fieldnames)
+
+    for propkey, (propvalue, proptype) in service.props.items():
+        propkey_ = str(propkey).replace(".", "__")
+        propfields[propkey_] = str(propvalue)
+        allfieldnames[propkey_] = None, proptype
+
+    # replaced rather than updated, as in-flight requests may be reading them
+    service.propfields = propfields
+    service.allfieldnames = allfieldnames
+
+
+def compile_plans(service):
+    """
+    Builds the script execution plan for each op of a script service
+    instance, from its props, keeping the existing plan of an op where its
+    script, language and prop files are unchanged
+
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
+    """
+
+    plans = {}
+    props = service.props
+    dockersrc = props.get(s_docker_src)
+
+    if service.type == s_type_scriptservice or dockersrc:
+        srcprop = s_docker_src if dockersrc else s_script_src
+
+        # if a script service, then we will execute
+        # as a python or eclipse-clp script or an ansible playbook based
+        # on the service instance properties which should specify a script to
+        # run
+        src = props.get(srcprop)
+        if src is not None:
+            scriptconfig, language = src
+
+            op_propprefix = srcprop + '.'
+            op_props = \
+                [(key[len(op_propprefix):], value)
+                 for key, (value, _type) in props.items()
+                 if key.startswith(op_propprefix)]
+
+            logger.debug(op_props)
+            logger.debug(scriptconfig)
+
+            for opid, op in service.ops.items():
+                plan = service.plans.get(opid)
+                if plan is None or plan.opname != op.name or \
+                        plan.language != language or \
+                        plan.script != scriptconfig or plan.props != op_props:
+                    plan = sparkl_script.ExecutionPlan(
+                        service.instanceid, op.name, language, scriptconfig,
+                        op_props)
+                plans[opid] = plan
+
+    oldplans = service.plans
+    built = [plan for opid, plan in plans.items()
+             if oldplans.get(opid) is not plan]
+    dropped = [plan for opid, plan in oldplans.items()
+               if plans.get(opid) is not plan]
+    logger.debug(
+        'plans of %s: %d built, %d dropped', service.instanceid, len(built),
+        len(dropped))
+
+    # the new plans are counted before the old ones are dropped, so that
+    # what they share is kept; events in flight may still be running the
+    # old ones, which are then released once those events are settled
+    sparkl_script.retain_plans(built)
+    service.plans = plans
+    with instance_lock:
+        if dropped and service.inflight:
+            service.retired.append((set(service.inflight), dropped))
+            dropped = []
+    sparkl_script.release_plans(dropped)
+
+
+def admit(msg_dict):
+    """
+    Counts a data event as in flight against its service instance, as the
+    transport hands it off its reader thread, so that the instance is not
+    torn down under it. Each admitted event is settled once handled.
+
+    :type: dict
+    :param msg_dict: decoded event
+    """
+
+    if msg_dict.get(s_tag) != et_dataevent:
+        return
+
+    eventattrs = msg_dict.get(s_attributes, {})
+    with instance_lock:
+        service = metadata.get(eventattrs.get(s_instanceid))
+        if service is not None and not service.closing:
+            service.inflight.add(eventattrs.get(s_id))
+
+
+def settle(msg_dict):
+    """
+    Counts an admitted event as handled, releasing the plans and completing
+    the teardown of its service instance where those waited on it
+
+    :type: dict
+    :param msg_dict: decoded event
+    """
+
+    eventattrs = msg_dict.get(s_attributes, {})
+    instanceid = eventattrs.get(s_instanceid)
+    eventid = eventattrs.get(s_id)
+    dropped = []
+    with instance_lock:
+        service = metadata.get(instanceid)
+        if service is None:
+            return
+        service.inflight.discard(eventid)
+
+        retired = []
+        for waiting, plans in service.retired:
+            waiting.discard(eventid)
+            if waiting:
+                retired.append((waiting, plans))
+            else:
+                dropped.extend(plans)
+        service.retired = retired
+
+        torndown = service.closing and not service.inflight
+        if torndown:
+            del metadata[instanceid]
+
+    sparkl_script.release_plans(dropped)
+    if torndown:
+        release(service)
+
+
+def teardown(instanceid):
+    """
+    Tears down a service instance, releasing its meta-data together with
+    its script modules, execution plans, prop files and metrics. Where
+    events are in flight against it, later events no longer find it but the
+    release waits until they are settled.
+
+    :type: str
+    :param instanceid: id of the service instance
+    """
+
+    with instance_lock:
+        service = metadata.get(instanceid)
+        if service is None:
+            return
+        if service.inflight:
+            service.closing = True
+            return
+        del metadata[instanceid]
+
+    release(service)
+
+
+def release(service):
+    """
+    Releases what a torn down service instance holds
+    """
+
+    instanceid = service.instanceid
+    logger.info('tearing down %s', instanceid)
+    plans = service.plans
+    service.plans = {}
+    sparkl_script.release_instance(instanceid, plans.values())
+    metrics.forget(instanceid)
+
+
+def evict(now):
+    """
+    Tears down the instances idle for longer than instance_idle, and then
+    the least recently used ones, leaving room for another instance within
+    instance_max. Instances with events in flight are left be.
+
+    :type: float
+    :param now: current time
+    """
+
+    idle = [
+        service for service in list(metadata.values())
+        if not service.inflight and not service.closing]
 
+    if instance_idle > 0:
+        for service in idle:
+            if now - service.lastused > instance_idle:
+                teardown(service.instanceid)
+                metrics.count('evicted')
+        idle = [service for service in idle if service.instanceid in metadata]
 
-def handle_request(instanceid, eventid, eventattrs, eventcontent, envpath):
+    if 0 < instance_max <= len(metadata):
+        byuse = sorted(idle, key=lambda service: service.lastused)
+        for service in byuse[:len(metadata) - instance_max + 1]:
+            teardown(service.instanceid)
+            metrics.count('evicted')
+
+
+def handle_request(service, op, eventid, eventattrs, eventcontent, envpath):
     """
     Handles incoming request operation, by calling registered callback
     (if not script service)
 
-    :type: str
-    :param instanceid: id of the pertaining service instance
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
 
+    :type: OpDescriptor
+    :param op: meta-data of the requested operation
 
     :type: str
     :param eventid: id of event
@@ -351,15 +864,39 @@ def handle_request(instanceid, eventid, eventattrs, eventcontent, envpath):
     :param envpath: location of instance env directory
     """
 
-    # process the incoming field set, into a dict of field *name*/value pairs
-    fields_ = process_fields_in(instanceid, eventcontent)
-    logger.debug(str(fields_))
+    fields_ = request_fields(service, op, eventcontent)
 
     # generate reply based on service type
-    ok, outputname, outputnamedfields = \
-        handle_based_on_type(instanceid, s_op_rr, eventattrs, fields_, envpath)
+    result = profiling.call(
+        service.instanceid, op.name,
+        handle_based_on_type, service, op, s_op_rr, fields_, envpath)
 
-    logger.debug(str((ok, outputname, outputnamedfields)))
+    return request_reply(service, op, eventid, eventattrs, fields_, result)
+
+
+def request_fields(service, op, eventcontent):
+    """
+    Processes the incoming field set of a request or one-way event, into a
+    dict of field *name*/value pairs, with the field meta-data
+    """
+
+    since = metrics.now()
+    fields_ = process_fields_in(service, eventcontent)
+    metrics.observe(metrics.s_fields_in, since, service.instanceid, op.name)
+    logger.debug('%s', fields_)
+    return fields_
+
+
+def request_reply(service, op, eventid, eventattrs, fields_, result):
+    """
+    Gives the reply to a request, from the outcome of handling it
+
+    :type: tuple
+    :param result: success, output name and output fields
+    """
+
+    ok, outputname, outputnamedfields = result
+    logger.debug('%s %s %s', ok, outputname, outputnamedfields)
 
     # if all was successful, generate a reply data event
     if ok:
@@ -368,18 +905,17 @@ def handle_request(instanceid, eventid, eventattrs, eventcontent, envpath):
         fields.update(outputnamedfields)
 
         logger.debug(fields)
-        opid = eventattrs.get(s_opid)
-        logger.debug(opid)
-        subject =  \
-            metadata.get(instanceid).get(s_md_opreplies).get(opid).\
-            get(outputname)
+        subject = op.replies.get(outputname)
         ref = eventattrs.get(s_id)
         logger.debug(subject)
 
+        since = metrics.now()
         serailized_event = \
-            serialize_data_event(ref, subject, instanceid, fields)
+            serialize_data_event(ref, subject, service, fields)
+        metrics.observe(
+            metrics.s_fields_out, since, service.instanceid, op.name)
 
-        logger.debug(str(serailized_event))
+        logger.debug('%s', serailized_event)
 
     else:
         subject = eventattrs.get(s_subject)
@@ -389,20 +925,20 @@ def handle_request(instanceid, eventid, eventattrs, eventcontent, envpath):
     return serailized_event
 
 
-def handle_based_on_type(instanceid, eventtype, eventattrs, fields_, envpath):
+def handle_based_on_type(service, op, eventtype, fields_, envpath):
     """
     Handles request or one-way based on service type.  Returns success
     and yielded outputname and fields if request/reply.
 
-    :type: str
-    :param instanceid: id of the pertaining service instance
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
+
+    :type: OpDescriptor
+    :param op: meta-data of the pertaining operation
 
     :type: str
     :param eventtype: type of pertaining operation event
 
-    :type: list
-    :param eventattrs: attributes of pertaining operation event
-
     :type: dict
     :param fields_: field set of pertaining operation, as dict of
     field *name*/value pairs
@@ -421,88 +957,66 @@ def handle_based_on_type(instanceid, eventtype, eventattrs, fields_, envpath):
     ok = True
 
     # get the instance service type, as this will determine the course of action
-    servicetype = metadata.get(instanceid).get(s_md_type)
+    servicetype = service.type
     logger.debug(servicetype)
 
-    # fetch the op id from the event
-    opid = eventattrs.get(s_opid)
-    logger.debug(opid)
-
-    # get corresponding op name
-    opname = metadata.get(instanceid).get(s_md_opids).get(opid)
+    instanceid = service.instanceid
+    opname = op.name
     logger.debug(opname)
 
     fields, fieldnames = fields_
     logger.debug(fields)
     logger.debug(fieldnames)
 
-    dockersrc = metadata. \
-        get(instanceid).get(s_md_props).get(s_docker_src)
+    dockersrc = service.props.get(s_docker_src)
+    plan = service.plans.get(op.id)
 
     if servicetype == s_type_containerservice and dockersrc is None:
         # if a container service, use the registered callback
         callback = callbacks.get(eventtype)
         if callback:
-            logger.debug(str(callback))
+            logger.debug('%s', callback)
+            since = metrics.now()
             ok, outputname, outputnamedfields = callback(opname, fields)
+            metrics.observe(
+                metrics.s_execute, since, instanceid, opname, 'callback')
             logger.debug(outputname)
-            logger.debug(str(outputnamedfields))
+            logger.debug('%s', outputnamedfields)
 
-    elif servicetype == s_type_scriptservice or dockersrc:
-        srcprop = s_docker_src if dockersrc else s_script_src
+    elif plan is not None:
+        logger.debug(plan)
 
-        # if a script service, then we will execute
-        # as a python or eclipse-clp script or an ansible playbook based
-        # on the service instance properties which should specify a script to
-        # run
-        props = metadata.get(instanceid).get(s_md_props)
-        scriptconfig, language = metadata.\
-            get(instanceid).get(s_md_props).get(srcprop)
-        props_keys = props.keys()
-
-        op_propprefix = srcprop + '.'
-        op_fileprops_keys = \
-            [key for key in props_keys if key.startswith(op_propprefix)]
-        op_props_ = \
-            [(str(key).replace(op_propprefix, ""), props.get(key))
-             for key in op_fileprops_keys]
-        op_props = \
-            [(key, value) for (key, (value, _type)) in op_props_]
-
-        logger.debug(op_props)
-        logger.debug(scriptconfig)
-        logger.debug(fields)
-        logger.debug(fieldnames)
-
-        ok, outputname, outputnamedfields = \
-            executeresults(
-                instanceid,
-                opname,
-                language,
-                scriptconfig,
-                fields,
-                fieldnames,
-                new_collect(instanceid),
-                op_props,
-                envpath)
+        collect = new_collect(instanceid)
+        since = metrics.now()
+        if sparkl_script.threadsafe:
+            ok, outputname, outputnamedfields = \
+                sparkl_script.executeplan(
+                    plan, fields, fieldnames, collect, envpath)
+        else:
+            with script_lock:
+                ok, outputname, outputnamedfields = \
+                    sparkl_script.executeplan(
+                        plan, fields, fieldnames, collect, envpath)
+        metrics.observe(
+            metrics.s_execute, since, instanceid, opname, plan.language)
     else:
         ok = False
 
-    logger.debug(ok, outputname, outputnamedfields)
+    logger.debug('%s %s %s', ok, outputname, outputnamedfields)
 
     return ok, outputname, outputnamedfields
 
 
-def handle_oneway(instanceid, eventattrs, eventcontent, envpath):
+def handle_oneway(service, op, eventcontent, envpath):
     """
     Handles incoming one way operation, by calling registered callback
     (if not script service)
 
-    :type: str
-    :param instanceid: id of the pertaining service instance
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
 
-    :type: list
-    :param eventattrs: attributes of the received one-way event
+    :type: OpDescriptor
+    :param op: meta-data of the received one-way operation
 
     :type: list
     :param eventcontent: content of the received one-way event
@@ -514,20 +1028,20 @@ def handle_oneway(instanceid, eventattrs, eventcontent, envpath):
     :param envpath: location of instance env directory
     """
 
-    # process the incoming field set, into a dict of field *name*/value pairs
-    fields = process_fields_in(instanceid, eventcontent)
-    logger.debug(str(fields))
+    fields = request_fields(service, op, eventcontent)
 
-    handle_based_on_type(instanceid, s_op_ow, eventattrs, fields, envpath)
+    profiling.call(
+        service.instanceid, op.name,
+        handle_based_on_type, service, op, s_op_ow, fields, envpath)
     return None
 
 
-def handle_response(instanceid, eventcontent):
+def handle_response(service, eventcontent):
     """
     Handles incoming response event by calling registered callback.
 
-    :type: str
-    :param instanceid: id of the pertaining service instance
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
 
     :type: list
     :param eventcontent: content of the received response event
@@ -536,7 +1050,7 @@ def handle_response(instanceid, eventcontent):
     :return: whether success and yielded reply (which will be None, as response)
     """
 
-    fields, _ = process_fields_in(instanceid, eventcontent)
+    fields, _ = process_fields_in(service, eventcontent)
     callback = callbacks.get(s_op_re)
     callback(fields)
     return None
@@ -557,21 +1071,29 @@ def collect_event(instanceid, opname, outputnamedfields):
     set
 
     :rtype: bool
-    :return: success or not of *collecting* event for dispatch
+    :return: success or not of *collecting* event for dispatch, being False
+    where the transport's outbound queue stayed full and the event was
+    dropped
     """
 
     if handle is None:
         return False
 
-    logger.debug("generating event to send, for: "+instanceid)
-    logger.debug(str(metadata.get(instanceid)))
+    logger.debug('generating event to send, for: %s', instanceid)
+    service = metadata.get(instanceid)
+    logger.debug('%s', service)
 
-    subject = metadata.get(instanceid).get(s_md_opnames).get(opname)
+    subject = service.opnames.get(opname)
+    since = metrics.now()
     serailized_event = \
-        serialize_data_event(instanceid, subject, instanceid, outputnamedfields)
+        serialize_data_event(instanceid, subject, service, outputnamedfields)
+    metrics.observe(metrics.s_fields_out, since, instanceid, opname)
 
-    handle(serailized_event)
+    if handle(serailized_event) is False:
+        metrics.count('dropped', instanceid, opname)
+        return False
 
+    metrics.count('collected', instanceid, opname)
     return True
 
 
@@ -580,13 +1102,13 @@ def new_collect(instanceid):
         collect_event(instanceid, opname, outputnamedfields)
 
 
-def process_fields_in(instanceid, eventcontent):
+def process_fields_in(service, eventcontent):
     """
     Processes incoming fields by converting from field ids/values embedded
     in a supplied eventcontent list, to a dict of field *name*/value pairs.
 
-    :type: str
-    :param instanceid: id of the pertaining service instance
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
 
     :type: list
     :param eventcontent: content of the received response event
@@ -596,62 +1118,33 @@ def process_fields_in(instanceid, eventcontent):
     """
 
     fields = {}
-    fieldnames = metadata.get(instanceid).get(s_md_fieldnames)
-    fieldids = metadata.get(instanceid).get(s_md_fieldids)
+    fieldids = service.fieldids
     for item in eventcontent:
         itemattrs = item.get(s_attributes, [])
         itemcontent = item.get(s_content)
-        logger.debug(itemattrs)
-        logger.debug(itemcontent)
-
         fieldid = itemattrs.get(s_fieldtag)
 
-        logger.debug(fieldnames)
-        logger.debug(fieldid)
-
-        if fieldid in fieldids.keys():
-            fieldvalue = itemcontent[0]
-            fields[str(fieldid)] = fieldvalue
-
-    fieldkeys = fields.keys()
-    logger.debug(fieldkeys)
-    if len(fieldkeys) > 0:
-        if str(fieldkeys[0]).startswith('B-'):  # this should always be the case
-            # we need to convert to field names
-            idfields = fields
-            fields = {}
-
-            for fieldkey in fieldkeys:
-                fieldname = fieldids.get(fieldkey)
-                fieldvalue = idfields.get(fieldkey)
-                fields[str(fieldname)] = fieldvalue
+        # convert field id to field name
+        fieldname = fieldids.get(fieldid)
+        if fieldname is not None:
+            fields[str(fieldname)] = itemcontent[0]
 
-    # add the props from the service as fields
-    props = metadata.get(instanceid).get(s_md_props)
-    props_ = {}
-    proptypes_ = {}
+    # add the props from the service as fields, the shared meta-data
+    # being left untouched
+    fields.update(service.propfields)
+    fieldnames = service.allfieldnames
 
-    for propkey in props.keys():
-        propkey_ = str(propkey).replace(".", "__")
-        propvalue, proptype = props[propkey]
-        props_[propkey_] = str(propvalue)
-        proptypes_[propkey_] = None, proptype
-
-    fields.update(props_)
-    fieldnames.update(proptypes_)
-
-    logger.debug(str(fields))
-    logger.debug(str(fieldnames))
+    logger.debug('%s', fields)
     return fields, fieldnames
 
 
-def serialize_data_event(ref, subject, instanceid, field_data):
+def serialize_data_event(ref, subject, service, field_data):
     return {s_tag: et_dataevent,
             s_attributes: {
                 s_ref: ref,
                 s_subject: subject
             },
-            s_content: process_fields_out(instanceid, field_data)}
+            s_content: process_fields_out(service, field_data)}
 
 
 def serialize_error_event(ref, subject, reason):
@@ -667,52 +1160,51 @@ def serialize_error_event(ref, subject, reason):
                 }]}
 
 
-def process_fields_out(instanceid, fields):
+def process_fields_out(service, fields):
     """
     Processes outgoing field-set by converting from a dict of
     field *name*/value pairs to a serialized form of field *id*/value pairs.
 
-    :type: str
-    :param instanceid: id of the pertaining service instance
+    :type: ServiceDescriptor
+    :param service: meta-data of the pertaining service instance
 
     :type: dict
     :param fields: field *name*/value pairs
     """
 
     outfields = []
-    fieldnames = metadata.get(instanceid).get(s_md_fieldnames)
+    fieldnames = service.fieldnames
     logger.debug(fields)
     logger.debug(fieldnames)
 
     for name in fields.keys():
-        logger.debug(name + " : " + str(fieldnames.get(name)))
         field = fieldnames.get(name)
         if field:
             fieldkey, fieldtype = field
             if fieldkey and fieldtype:
-                logger.debug(fields.get(name))
                 outfields.append(
                     {s_tag: s_datumtag,
                      s_attributes: {
                          s_fieldtag: fieldkey
                      },
                      s_content: [fields.get(name)]})
+
+    logger.debug(outfields)
     return outfields
 
 
 def handle_internal(msg_, scriptsrc):
-    msg = str(msg_)
-    logger.debug(msg)
+    logger.debug(msg_)
 
     # convert JSON message to dict
-    msg_dict = json.loads(msg)
+    msg_dict = codec.loads(msg_)
     logger.debug(msg_dict)
 
     fieldsin = msg_dict[s_attributes]
     logger.debug(fieldsin)
     logger.debug(scriptsrc)
     fieldsout = \
-        execute_as_python(
+        sparkl_script.execute_as_python(
             fieldsin[s_instanceid],
             s_main_op,
             s_undefined,
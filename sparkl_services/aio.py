@@ -0,0 +1,306 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Module for services to handle communication with SPARKL, where protocol is
+websockets driven from an asyncio event loop.
+Offers the same start entry point and sparkl_services.handle hook as
+sparkl_services.ws, but keeps many requests in flight at once, with
+backpressure applied to the connection once the in-flight limit is reached.
+The processes run by one-shot eclipse-clp and ansible executions are run as
+asyncio subprocesses, so that a request waiting on one holds no thread.
+Selected by SPARKL_TRANSPORT=aio, and needs the websockets package.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import websockets
+import sparkl_script
+import sparkl_services
+from sparkl_services import batch, capture, metrics, profiling
+from sparkl_services import outbound as outbound_
+
+envpath = None
+logger = logging.getLogger(__name__)
+
+# maximum number of events being handled at once, after which no further
+# frames are read from the connection until one completes
+inflight = int(os.environ.get('SPARKL_AIO_INFLIGHT', 256))
+
+# number of threads running the (blocking) handlers, and script executors
+# other than the processes they run, on behalf of the in-flight events
+threads = int(os.environ.get('SPARKL_AIO_THREADS', 8))
+
+# capture of the frames exchanged, where recording
+recorder = None
+
+
+def start(hosturl, args):
+    """
+    Init a websocket communication, and run over it forever
+
+    :type: str
+    :param hosturl: the url to connect with
+
+    :type: str
+    :param args: original container args
+    """
+
+    global envpath
+
+    logger.debug(args)
+
+    secure = False
+    envpath = os.getcwd()
+
+    expected = 7
+    if len(args) == expected:
+        secure = True if args[5] == 'true' else False
+        envpath = args[6]
+
+    logger.debug(secure)
+    logger.debug(envpath)
+
+    wsprefix = "ws"
+    if secure:
+        wsprefix += "s"
+
+    metrics.start()
+    profiling.install()
+
+    global recorder
+    recorder = capture.writer()
+    asyncio.run(run(wsprefix + '://' + hosturl))
+
+
+async def run(url):
+    """
+    Reads events from the connection, handling each as a task, and writes
+    replies and collected events back from a single writer task
+
+    :type: str
+    :param url: the url to connect with
+    """
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(threads)
+    outbound = asyncio.Queue(outbound_.depth)
+    slots = asyncio.Semaphore(inflight)
+    tasks = set()
+
+    # collected events may be generated on any executor thread, which is
+    # held back whilst the outbound queue is full
+    sparkl_services.handle = \
+        lambda event: collect(
+            loop, outbound, sparkl_services.encode_msg(event))
+
+    async with websockets.connect(url) as conn:
+        logger.info("### open websocket")
+        # outbound events are only batched where the connect url asked
+        # for it
+        writer = asyncio.ensure_future(
+            write(conn, outbound, batch.negotiated(url)))
+
+        try:
+            async for message in conn:
+                if recorder is not None:
+                    recorder.write(capture.INBOUND, message)
+                events = batch.unbatch(sparkl_services.decode_msg(message))
+
+                for msg_dict in events:
+                    # open, aggregate and close events change the instances
+                    # that subsequent data events are handled against, so
+                    # are handled in order
+                    if msg_dict.get(sparkl_services.s_tag) in \
+                            sparkl_services.ordered_events:
+                        await handle_event(loop, executor, outbound, msg_dict)
+                        continue
+
+                    # holding off the teardown of its instance until handled
+                    await slots.acquire()
+                    sparkl_services.admit(msg_dict)
+                    task = asyncio.ensure_future(
+                        handle_event(
+                            loop, executor, outbound, msg_dict, admitted=True))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _task: slots.release())
+        finally:
+            logger.info("### closed websocket ")
+            for task in list(tasks):
+                task.cancel()
+            writer.cancel()
+            executor.shutdown(wait=False)
+
+
+async def handle_event(loop, executor, outbound, msg_dict, admitted=False):
+    """
+    Handles a decoded event on the executor, and queues any reply for sending,
+    settling the event where it was admitted
+    """
+
+    try:
+        # call transport neutral handling library
+        reply = await runsteps(
+            loop, executor,
+            sparkl_services.handle_event_steps(msg_dict, envpath))
+    except Exception as e:
+        logger.error(e)
+        return
+    finally:
+        if admitted:
+            await loop.run_in_executor(
+                executor, sparkl_services.settle, msg_dict)
+
+    logger.debug('%s', reply)
+
+    if reply is not None:
+        await outbound.put(sparkl_services.encode_msg(reply))
+
+
+async def runsteps(loop, executor, steps):
+    """
+    Takes the steps of handling an event on the executor, running the
+    processes they yield as asyncio subprocesses in between
+
+    :rtype: dict
+    :return: yielded reply, if any
+    """
+
+    step = await loop.run_in_executor(executor, next, steps)
+    while not isinstance(step, sparkl_script.Done):
+        try:
+            outcome = await runcommand(loop, step)
+        except Exception as e:
+            step = await loop.run_in_executor(executor, steps.throw, e)
+        else:
+            step = await loop.run_in_executor(executor, steps.send, outcome)
+
+    return step.result
+
+
+async def runcommand(loop, command):
+    """
+    Runs the process of a script execution step
+
+    :type: sparkl_script.Command
+    :param command: the process to run
+
+    :rtype: str
+    :return: what it wrote to its result pipe, if it has one
+    """
+
+    pipe = command.pipe
+    if pipe is None:
+        process = await asyncio.create_subprocess_exec(
+            *command.args, cwd=command.cwd, env=command.env)
+        await process.wait()
+        return None
+
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command.args, cwd=command.cwd, env=command.env,
+                pass_fds=(pipe.writefd,))
+        finally:
+            pipe.closewrite()
+
+        # the read end is handed over to the pipe transport, which closes it
+        reader = asyncio.StreamReader()
+        src_ = os.fdopen(pipe.readfd, 'rb', 0)
+        pipe.readfd = None
+        try:
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), src_)
+        except Exception:
+            src_.close()
+            raise
+
+        try:
+            result = await reader.read()
+        finally:
+            transport.close()
+    finally:
+        pipe.close()
+
+    await process.wait()
+    return result.decode('utf-8') or None
+
+
+def collect(loop, outbound, event):
+    """
+    Queues a collected event from an executor thread, waiting for room up to
+    the outbound timeout
+
+    :rtype: bool
+    :return: whether the event was queued
+    """
+
+    timeout = outbound_.timeout
+    if timeout < 0:
+        timeout = None
+
+    future = asyncio.run_coroutine_threadsafe(
+        asyncio.wait_for(outbound.put(event), timeout), loop)
+    try:
+        future.result()
+    except (asyncio.TimeoutError, FutureTimeoutError):
+        logger.warning('outbound queue full, dropped event')
+        return False
+
+    return True
+
+
+async def write(conn, outbound, policy):
+    """
+    Sole writer on the connection, sending queued events in order, and
+    coalescing them into batched frames where batching
+
+    :type: tuple
+    :param policy: negotiated batch flush policy, or None where not batching
+    """
+
+    while True:
+        event = await outbound.get()
+
+        if policy is not None:
+            event = batch.frame(await gather(outbound, event, *policy))
+
+        logger.debug('sending event: %s', event)
+        if recorder is not None:
+            recorder.write(capture.OUTBOUND, event)
+        since = metrics.now()
+        await conn.send(event)
+        metrics.observe(metrics.s_send, since)
+
+
+async def gather(outbound, event, maxevents, maxbytes, maxdelay):
+    """
+    Gathers queued events into a batch, starting with the given one, until
+    the batch is full or its delay, in milliseconds, is up
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + maxdelay / 1000.0
+    events = [event]
+    size = len(event)
+
+    while len(events) < maxevents and size < maxbytes:
+        try:
+            event = outbound.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(outbound.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        events.append(event)
+        size += len(event)
+
+    return events
@@ -0,0 +1,174 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Batch framing of events sent over the message transport.
+Where batching is negotiated, by way of the connect url parameters, SPARKL
+may send a JSON array of events in a frame, and outbound events are
+coalesced into JSON arrays, flushed once a batch reaches a number of events
+or bytes, or has been waiting for a given time, whichever comes first.
+"""
+
+import logging
+import os
+import threading
+import time
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# whether to ask for batched frames
+enabled = os.environ.get('SPARKL_BATCH', 'false') == 'true'
+
+# flush policy - maximum events and (encoded) bytes in an outbound batch
+maxevents = int(os.environ.get('SPARKL_BATCH_EVENTS', 64))
+maxbytes = int(os.environ.get('SPARKL_BATCH_BYTES', 65536))
+
+# flush policy - maximum time, in milliseconds, an outbound event waits
+# for its batch to fill
+maxdelay = int(os.environ.get('SPARKL_BATCH_DELAY', 2))
+
+
+def urlparams():
+    """
+    Gives the connect url parameters negotiating the framing, to be appended
+    to the query string
+
+    :rtype: str
+    """
+    if not enabled:
+        return ''
+    return '&batch=true&batch_events=' + str(maxevents) + \
+        '&batch_bytes=' + str(maxbytes) + \
+        '&batch_delay=' + str(maxdelay)
+
+
+def negotiated(url):
+    """
+    Gives the flush policy negotiated by a connect url, where its parameters
+    ask for batched frames, as given by urlparams
+
+    :type: str
+    :param url: the connect url
+
+    :rtype: tuple
+    :return: maximum events, bytes and delay of an outbound batch, or None
+    where batching is not negotiated
+    """
+
+    _, _, query = url.partition('?')
+    params = dict(
+        (name, values[-1]) for name, values in parse_qs(query).items())
+    if params.get('batch') != 'true':
+        return None
+
+    return (
+        int(params.get('batch_events', maxevents)),
+        int(params.get('batch_bytes', maxbytes)),
+        int(params.get('batch_delay', maxdelay)))
+
+
+def frame(events):
+    """
+    Joins encoded events into a batched frame
+
+    :type: list
+    :param events: JSON encoded events
+    """
+    return '[' + ','.join(events) + ']'
+
+
+def unbatch(msg_dict):
+    """
+    Gives the events of a decoded frame, as a list
+    """
+    if isinstance(msg_dict, list):
+        return msg_dict
+    return [msg_dict]
+
+
+class Batcher(object):
+    """
+    Coalesces encoded events, from any thread, into batched frames handed to
+    a send function. Frames are sent in the order their events were added.
+    """
+
+    def __init__(self, send, maxevents_, maxbytes_, maxdelay_):
+        self.send = send
+        self.maxevents = maxevents_
+        self.maxbytes = maxbytes_
+        self.maxdelay = maxdelay_ / 1000.0
+        self.cond = threading.Condition()
+        self.events = []
+        self.size = 0
+        self.deadline = None
+        self.closed = False
+
+        self.thread = threading.Thread(
+            target=self.run, name='sparkl_batch_flusher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, event):
+        """
+        Adds an encoded event to the current batch, sending the batch if
+        that fills it
+
+        :type: str
+        :param event: JSON encoded event
+        """
+
+        with self.cond:
+            self.events.append(event)
+            self.size += len(event)
+
+            if len(self.events) >= self.maxevents or \
+                    self.size >= self.maxbytes:
+                self.flushlocked()
+            elif self.deadline is None:
+                self.deadline = time.time() + self.maxdelay
+                self.cond.notify()
+
+    def flush(self):
+        """
+        Sends the current batch, if any
+        """
+        with self.cond:
+            self.flushlocked()
+
+    def close(self):
+        with self.cond:
+            self.flushlocked()
+            self.closed = True
+            self.cond.notify()
+
+    def flushlocked(self):
+        # sent whilst holding the lock, so that frames keep their order
+        if not self.events:
+            return
+
+        events = self.events
+        self.events = []
+        self.size = 0
+        self.deadline = None
+
+        try:
+            self.send(frame(events))
+        except Exception as e:
+            logger.error(e)
+
+    def run(self):
+        with self.cond:
+            while not self.closed:
+                if self.deadline is None:
+                    self.cond.wait()
+                    continue
+
+                remaining = self.deadline - time.time()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                else:
+                    self.flushlocked()
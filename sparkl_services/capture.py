@@ -0,0 +1,145 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Capture of the frames exchanged over the message transport, to an
+append-only file, for replay offline.
+The file starts with a magic string, followed by a record per frame: its
+direction (I for inbound, O for outbound), its timestamp as a double,
+and its length, as an unsigned 32 bit integer, all network order, followed
+by the frame itself, utf-8 encoded.
+"""
+
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# capture file, no capture where not given
+capturefile = os.environ.get('SPARKL_WS_RECORD')
+
+s_magic = b'SPARKLCAP1\n'
+s_record = struct.Struct('!cdI')
+
+INBOUND = b'I'
+OUTBOUND = b'O'
+
+
+class CaptureWriter(object):
+    """
+    Appends frames to a capture file, from any thread. Each record is
+    written out with a single write, unbuffered, so that a container being
+    killed loses no more than the record being written, which is cut off
+    the file before appending to it again.
+    """
+
+    def __init__(self, path):
+        fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not fresh:
+            end = complete(path)
+            if end < os.path.getsize(path):
+                logger.warning(
+                    'truncating partial record at %d of %s', end, path)
+                dst_ = open(path, 'r+b')
+                dst_.truncate(end)
+                dst_.close()
+
+        self.lock = threading.Lock()
+        self.dst = open(path, 'ab', 0)
+        if fresh:
+            self.dst.write(s_magic)
+        atexit.register(self.close)
+
+    def write(self, direction, frame):
+        """
+        Appends a frame
+
+        :type: bytes
+        :param direction: INBOUND or OUTBOUND
+
+        :type: str
+        :param frame: the frame, as str or bytes
+        """
+
+        if not isinstance(frame, bytes):
+            frame = frame.encode('utf-8')
+        header = s_record.pack(direction, time.time(), len(frame))
+
+        with self.lock:
+            if self.dst is None:
+                return
+            self.dst.write(header + frame)
+
+    def close(self):
+        with self.lock:
+            if self.dst is not None:
+                self.dst.close()
+                self.dst = None
+
+
+def complete(path):
+    """
+    Gives the length of the complete records of a capture file, its magic
+    string included
+
+    :rtype: int
+    """
+
+    src_ = open(path, 'rb')
+    try:
+        if src_.read(len(s_magic)) != s_magic:
+            raise IOError('not a capture file: ' + path)
+
+        end = len(s_magic)
+        while True:
+            header = src_.read(s_record.size)
+            if len(header) < s_record.size:
+                return end
+            _direction, _timestamp, length = s_record.unpack(header)
+            if len(src_.read(length)) < length:
+                return end
+            end += s_record.size + length
+    finally:
+        src_.close()
+
+
+def read(path):
+    """
+    Reads the frames of a capture file, in order, stopping at a truncated
+    final record
+
+    :rtype: generator
+    :return: (direction, timestamp, frame) tuples, frame being str
+    """
+
+    src_ = open(path, 'rb')
+    try:
+        if src_.read(len(s_magic)) != s_magic:
+            raise IOError('not a capture file: ' + path)
+
+        while True:
+            header = src_.read(s_record.size)
+            if len(header) < s_record.size:
+                return
+            direction, timestamp, length = s_record.unpack(header)
+            frame = src_.read(length)
+            if len(frame) < length:
+                return
+            yield direction, timestamp, frame.decode('utf-8')
+    finally:
+        src_.close()
+
+
+def writer():
+    """
+    Gives a writer to the configured capture file, None where not capturing
+    """
+
+    if not capturefile:
+        return None
+
+    logger.info('capturing frames to %s', capturefile)
+    return CaptureWriter(capturefile)
@@ -0,0 +1,60 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+JSON codec for events sent and received over the message transport.
+Uses a faster parser/serializer (orjson or ujson) where one is installed,
+falling back to the standard library json module otherwise.
+loads accepts the message as received, str or bytes, and dumps always
+gives str, so that events are sent as text frames.
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# codec to use - one of 'orjson', 'ujson' or 'json' - defaulting to the
+# fastest one installed
+preferred = os.environ.get('SPARKL_JSON_CODEC')
+
+orjson = None
+ujson = None
+
+if preferred in (None, 'orjson'):
+    try:
+        import orjson
+    except ImportError:
+        pass
+
+if orjson is None and preferred in (None, 'ujson'):
+    try:
+        import ujson
+    except ImportError:
+        pass
+
+if orjson is not None:
+    name = 'orjson'
+    orjson_options = orjson.OPT_NON_STR_KEYS
+    loads = orjson.loads
+
+    def dumps(event):
+        try:
+            return orjson.dumps(event, option=orjson_options).decode('utf-8')
+        except TypeError:
+            # e.g. integers beyond 64 bits, which json handles
+            return json.dumps(event)
+
+elif ujson is not None:
+    name = 'ujson'
+    loads = ujson.loads
+
+    def dumps(event):
+        return ujson.dumps(event, escape_forward_slashes=False)
+
+else:
+    name = 'json'
+    loads = json.loads
+    dumps = json.dumps
+
+logger.debug('using json codec: %s', name)
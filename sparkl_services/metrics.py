@@ -0,0 +1,279 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Instrumentation of event handling, as latency histograms per phase
+(decode, lookup, fields_in, execute, fields_out, encode, send), keyed by
+service instance and op name, together with event counters and the python
+script module cache counters.
+Metrics are pulled as JSON over HTTP, on a local port or unix socket, and/or
+written periodically to a snapshot file.
+"""
+
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import sparkl_script
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+
+logger = logging.getLogger(__name__)
+
+# whether to collect metrics
+enabled = os.environ.get('SPARKL_METRICS', 'false') == 'true'
+
+# pull endpoint - a port, host:port or, starting with '/', a unix socket path
+address = os.environ.get('SPARKL_METRICS_ADDR')
+
+# snapshot file, written every interval seconds
+snapshotfile = os.environ.get('SPARKL_METRICS_SNAPSHOT')
+interval = float(os.environ.get('SPARKL_METRICS_INTERVAL', 10))
+
+# histogram bucket upper bounds, in seconds, the last bucket being unbounded
+s_bounds = [
+    0.000001, 0.0000025, 0.000005,
+    0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0]
+
+# phases
+s_decode = 'decode'
+s_lookup = 'lookup'
+s_fields_in = 'fields_in'
+s_execute = 'execute'
+s_fields_out = 'fields_out'
+s_encode = 'encode'
+s_send = 'send'
+
+now = getattr(time, 'perf_counter', time.time)
+
+started = time.time()
+lock = threading.Lock()
+
+# (phase, instance id, op name, language) to Histogram
+histograms = {}
+
+# (counter name, instance id, op name) to count
+counters = {}
+
+servers = []
+
+
+class Histogram(object):
+    """
+    Latency histogram over fixed buckets, with count, sum and maximum.
+    """
+
+    __slots__ = ('count', 'sum', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(s_bounds) + 1)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.sum += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.buckets[bisect.bisect_left(s_bounds, elapsed)] += 1
+
+
+def observe(phase, since, instanceid=None, opname=None, language=None):
+    """
+    Records the time taken by a phase
+
+    :type: str
+    :param phase: name of the phase
+
+    :type: float
+    :param since: time the phase started, as given by now()
+
+    :type: str
+    :param instanceid: id of the pertaining service instance, if any
+
+    :type: str
+    :param opname: name of the pertaining op, if any
+
+    :type: str
+    :param language: script language, for the execute phase
+    """
+
+    if not enabled:
+        return
+
+    elapsed = now() - since
+    key = (phase, instanceid, opname, language)
+
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.add(elapsed)
+
+
+def count(name, instanceid=None, opname=None, n=1):
+    """
+    Adds to a counter
+
+    :type: str
+    :param name: name of the counter
+    """
+
+    if not enabled:
+        return
+
+    key = (name, instanceid, opname)
+    with lock:
+        counters[key] = counters.get(key, 0) + n
+
+
+def forget(instanceid):
+    """
+    Drops the histograms and counters of a service instance, once it is
+    torn down
+
+    :type: str
+    :param instanceid: id of the service instance
+    """
+
+    with lock:
+        for key in [key for key in histograms if key[1] == instanceid]:
+            del histograms[key]
+        for key in [key for key in counters if key[1] == instanceid]:
+            del counters[key]
+
+
+def snapshot():
+    """
+    Gives the current metrics
+
+    :rtype: dict
+    :return: uptime, histograms, counters and module cache counters, each
+    histogram giving its bucket counts against the bucket upper bounds
+    """
+
+    with lock:
+        hists = [
+            {'phase': phase,
+             'instance': instanceid,
+             'op': opname,
+             'language': language,
+             'count': histogram.count,
+             'sum': histogram.sum,
+             'max': histogram.max,
+             'buckets': list(histogram.buckets)}
+            for (phase, instanceid, opname, language), histogram
+            in histograms.items()]
+        counts = [
+            {'name': name,
+             'instance': instanceid,
+             'op': opname,
+             'count': value}
+            for (name, instanceid, opname), value in counters.items()]
+
+    return {
+        'uptime': time.time() - started,
+        'bounds': s_bounds,
+        'histograms': hists,
+        'counters': counts,
+        'module_cache': sparkl_script.module_cache_stats()}
+
+
+def start():
+    """
+    Starts the pull endpoint and snapshot writer, where configured
+    """
+
+    if not enabled or servers:
+        return
+
+    if address:
+        server = listen(address)
+        thread = threading.Thread(
+            target=server.serve_forever, name='sparkl_metrics_server')
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        logger.info('metrics served on %s', address)
+
+    if snapshotfile:
+        thread = threading.Thread(
+            target=writesnapshots, name='sparkl_metrics_snapshot')
+        thread.daemon = True
+        thread.start()
+
+
+def listen(address_):
+    if address_.startswith('/'):
+        if os.path.exists(address_):
+            os.unlink(address_)
+        return ThreadingUnixHTTPServer(address_, MetricsHandler)
+
+    host, _, port = address_.rpartition(':')
+    return ThreadingHTTPServer(
+        (host or '127.0.0.1', int(port)), MetricsHandler)
+
+
+def writesnapshots():
+    while True:
+        time.sleep(interval)
+        try:
+            writesnapshot(snapshotfile)
+        except (IOError, OSError) as e:
+            logger.error(e)
+
+
+def writesnapshot(path):
+    # written to a temporary file and renamed into place, so that readers
+    # never see a partly written snapshot
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    dst_ = os.fdopen(fd, 'w')
+    try:
+        json.dump(snapshot(), dst_)
+    finally:
+        dst_.close()
+    os.rename(tmppath, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics snapshot as JSON, whatever the path
+    """
+
+    def do_GET(self):
+        body = json.dumps(snapshot()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_, *args):
+        logger.debug(format_, *args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # unix socket clients have no address, as the handler expects
+        request, _ = self.socket.accept()
+        return request, ('', 0)
@@ -0,0 +1,110 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Bounded queue of outbound events, drained by a single writer thread.
+Replies and collected (notify) events are queued by whichever thread
+produces them, and sent in the order they were queued, so that the events
+of a service instance keep their order and only the writer touches the
+connection. A producer finding the queue full waits for room, up to a
+timeout in the case of collected events, so that a script emitting events
+faster than they can be sent is held back, and told once it is dropping
+them.
+"""
+
+import logging
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# maximum number of events awaiting the writer
+depth = int(os.environ.get('SPARKL_OUTBOUND_DEPTH', 1024))
+
+# seconds a script collecting an event waits for room in a full queue,
+# before the event is dropped and collect_event gives False; a negative
+# value waits indefinitely
+timeout = float(os.environ.get('SPARKL_OUTBOUND_TIMEOUT', 30))
+
+# queued in place of an event, to have the writer flush
+s_flush = object()
+
+
+class OutboundQueue(object):
+    """
+    Bounded queue of encoded events, handed in order to a send function
+    by a writer thread, along with an optional flush function where the
+    send function buffers.
+    """
+
+    def __init__(self, send, depth_, flush=None):
+        self.send = send
+        self.flushsend = flush
+        self.queue = queue.Queue(depth_)
+        self.dropped = 0
+
+        self.thread = threading.Thread(
+            target=self.run, name='sparkl_outbound_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, event, timeout_=None):
+        """
+        Queues an encoded event for sending
+
+        :type: str
+        :param event: JSON encoded event
+
+        :type: float
+        :param timeout_: seconds to wait for room, where the queue is full,
+        None or a negative value waiting indefinitely
+
+        :rtype: bool
+        :return: whether the event was queued
+        """
+
+        if timeout_ is not None and timeout_ < 0:
+            timeout_ = None
+
+        try:
+            self.queue.put(event, True, timeout_)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(
+                'outbound queue full, dropped event (%d dropped)',
+                self.dropped)
+            return False
+
+        return True
+
+    def flush(self):
+        """
+        Has the writer flush the send function, once it has sent the events
+        queued so far
+        """
+        if self.flushsend is not None:
+            self.queue.put(s_flush)
+
+    def close(self):
+        """
+        Sends whatever is queued, then stops the writer
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                if event is s_flush:
+                    self.flushsend()
+                else:
+                    self.send(event)
+            except Exception as e:
+                logger.error(e)
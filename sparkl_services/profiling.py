@@ -0,0 +1,246 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+On-demand profiling of live containers. A profiling session wraps the
+handling of requests for a chosen service instance and/or op in cProfile,
+aggregating the stats over the requests profiled, and dumps them to disk
+after a number of requests or seconds, whichever comes first.
+A session is started from the environment at startup, by signal (SIGUSR1
+toggling it), or by a profile control event.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# whether to start a session at startup
+atstart = os.environ.get('SPARKL_PROFILE', 'false') == 'true'
+
+# service instance id and op name to profile, all where not given
+instance = os.environ.get('SPARKL_PROFILE_INSTANCE')
+opname = os.environ.get('SPARKL_PROFILE_OP')
+
+# a session ends after this many profiled requests or seconds
+requests = int(os.environ.get('SPARKL_PROFILE_REQUESTS', 100))
+seconds = float(os.environ.get('SPARKL_PROFILE_SECONDS', 60))
+
+# where stats are dumped
+dumpdir = os.environ.get('SPARKL_PROFILE_DIR', tempfile.gettempdir())
+
+# number of functions listed in the text summary
+s_summary_lines = 50
+
+# control event attributes
+s_action = 'action'
+s_action_start = 'start'
+s_action_stop = 'stop'
+s_instance = 'instance'
+s_op = 'op'
+s_requests = 'requests'
+s_seconds = 'seconds'
+
+# current session, if any
+session = None
+lock = threading.Lock()
+
+
+class ProfileSession(object):
+    """
+    Profiles the handling of matching requests, until stopped.
+    Requests are profiled one at a time, as the profiler may be process
+    wide; those arriving whilst another is profiled run unprofiled.
+    """
+
+    def __init__(self, instanceid, opname_, requests_, seconds_):
+        self.instanceid = instanceid
+        self.opname = opname_
+        self.requests = requests_
+        self.started = time.time()
+        self.stats = None
+        self.count = 0
+        self.busy = threading.Lock()
+        self.timer = threading.Timer(seconds_, stop, (self,))
+        self.timer.daemon = True
+
+    def matches(self, instanceid, opname_):
+        return (self.instanceid is None or self.instanceid == instanceid) \
+            and (self.opname is None or self.opname == opname_)
+
+    def call(self, func, args):
+        if not self.busy.acquire(False):
+            return func(*args)
+
+        try:
+            profile = cProfile.Profile()
+            result = profile.runcall(func, *args)
+
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.count += 1
+            done = self.count >= self.requests
+        finally:
+            self.busy.release()
+
+        if done:
+            stop(self)
+        return result
+
+    def dump(self):
+        if self.stats is None:
+            logger.info('profiling stopped, no requests profiled')
+            return None
+
+        name = 'sparkl_profile_' + str(self.instanceid or 'all') + '_' + \
+            str(self.opname or 'all') + '_' + str(int(self.started))
+        path = os.path.join(dumpdir, name)
+
+        with self.busy:
+            self.stats.dump_stats(path + '.prof')
+
+            # readable summary, alongside the stats for pstats/snakeviz
+            dst_ = open(path + '.txt', 'w')
+            self.stats.stream = dst_
+            dst_.write(
+                str(self.count) + ' requests, ' +
+                str(time.time() - self.started) + ' seconds\n')
+            self.stats.sort_stats('cumulative').print_stats(s_summary_lines)
+            dst_.close()
+
+        logger.info('profile of %d requests dumped to %s', self.count, path)
+        return path
+
+
+def start(instanceid=None, opname_=None, requests_=None, seconds_=None):
+    """
+    Starts a profiling session, replacing any current one
+
+    :type: str
+    :param instanceid: service instance to profile, all where None
+
+    :type: str
+    :param opname_: op to profile, all where None
+
+    :type: int
+    :param requests_: number of requests after which to stop
+
+    :type: float
+    :param seconds_: number of seconds after which to stop
+    """
+
+    global session
+
+    new = ProfileSession(
+        instanceid,
+        opname_,
+        requests if requests_ is None else int(requests_),
+        seconds if seconds_ is None else float(seconds_))
+
+    with lock:
+        old, session = session, new
+
+    if old is not None:
+        stop(old)
+
+    new.timer.start()
+    logger.info('profiling %s %s', instanceid, opname_)
+
+
+def stop(session_=None):
+    """
+    Stops a profiling session, the current one where not given, and dumps
+    its stats
+
+    :rtype: str
+    :return: path of the dumped stats, without extension, if any
+    """
+
+    global session
+
+    with lock:
+        if session_ is None:
+            session_ = session
+        if session_ is None or session_ is not session:
+            return None
+        session = None
+
+    session_.timer.cancel()
+    return session_.dump()
+
+
+def profiled(instanceid, opname_):
+    """
+    Whether requests for the given instance and op are being profiled
+    """
+
+    session_ = session
+    return session_ is not None and session_.matches(instanceid, opname_)
+
+
+def call(instanceid, opname_, func, *args):
+    """
+    Calls a request handling function, profiling it where a session is
+    profiling the given instance and op
+    """
+
+    session_ = session
+    if session_ is None or not session_.matches(instanceid, opname_):
+        return func(*args)
+    return session_.call(func, args)
+
+
+def control(attrs):
+    """
+    Handles a profile control event, starting or stopping a session
+
+    :type: dict
+    :param attrs: attributes of the event - action (start or stop), and for
+    start, optionally instance, op, requests and seconds
+    """
+
+    if attrs.get(s_action, s_action_start) == s_action_stop:
+        stop()
+    else:
+        start(
+            attrs.get(s_instance),
+            attrs.get(s_op),
+            attrs.get(s_requests),
+            attrs.get(s_seconds))
+
+
+def toggle(_signum, _frame):
+    # the signal may interrupt a profiled request on the main thread, so the
+    # session is started or stopped on a thread of its own
+    thread = threading.Thread(target=toggled, name='sparkl_profile_toggle')
+    thread.daemon = True
+    thread.start()
+
+
+def toggled():
+    if session is None:
+        start(instance, opname)
+    else:
+        stop()
+
+
+def install():
+    """
+    Installs the SIGUSR1 toggle, and starts a session where so configured.
+    Called from the main thread, by the transport.
+    """
+
+    try:
+        signal.signal(signal.SIGUSR1, toggle)
+    except (AttributeError, ValueError) as e:
+        logger.warning('no profiling signal: %s', e)
+
+    if atstart:
+        start(instance, opname)
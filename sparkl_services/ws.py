@@ -9,13 +9,42 @@ particular events and then proceeds to start the service.
 
 import logging
 import websocket
-import json
 import sparkl_services
+from sparkl_services import batch, capture, metrics, outbound, profiling
 import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 envpath = None
 logger = logging.getLogger(__name__)
 
+# pipelined mode - number of worker threads handling events, where 0 means
+# events are handled inline on the websocket reader thread
+workers = int(os.environ.get('SPARKL_WS_WORKERS', 0))
+
+# pipelined mode - depth of the queue of decoded events awaiting a worker;
+# the reader thread blocks once it is full
+queuedepth = int(os.environ.get('SPARKL_WS_QUEUEDEPTH', 64))
+
+pool = None
+
+# outbound batcher, where batched framing is negotiated
+batcher = None
+
+# outbound queue, drained by the sole writer of events to the websocket
+writer = None
+
+# capture of the frames exchanged, where recording
+recorder = None
+
+# websocket sends are not thread safe, so are serialized between the writer
+# and the batcher
+sendlock = threading.Lock()
+
 
 def start(hosturl, args):
     """
@@ -45,6 +74,16 @@ def start(hosturl, args):
     logger.debug(secure)
     logger.debug(envpath)
 
+    metrics.start()
+    profiling.install()
+
+    global recorder
+    recorder = capture.writer()
+
+    global pool
+    if workers > 0:
+        pool = WorkerPool(workers, queuedepth)
+
     websocket.enableTrace(True)
     wsprefix = "ws"
     if secure:
@@ -55,14 +94,43 @@ def start(hosturl, args):
         on_error=on_error,
         on_close=on_close)
     ws.on_open = on_open
+
+    # outbound events are only batched where the connect url asked for it
+    global batcher, writer
+    policy = batch.negotiated(hosturl)
+    if policy is not None:
+        maxevents, maxbytes, maxdelay = policy
+        batcher = batch.Batcher(
+            lambda frame: sendevent(ws, frame),
+            maxevents,
+            maxbytes,
+            maxdelay)
+        writer = outbound.OutboundQueue(
+            batcher.add, outbound.depth, batcher.flush)
+    else:
+        writer = outbound.OutboundQueue(
+            lambda event: sendevent(ws, event), outbound.depth)
+
+    # collected events are held back, where the writer is behind, for up to
+    # the outbound timeout
     sparkl_services.handle = \
-        lambda event: sendevent(ws, json.dumps(event))
+        lambda event: writer.put(
+            sparkl_services.encode_msg(event), outbound.timeout)
     ws.run_forever()
 
+    writer.close()
+    if batcher is not None:
+        batcher.close()
+
 
 def sendevent(ws, event):
-    logger.debug("sending event: "+str(event))
-    ws.send(event)
+    logger.debug('sending event: %s', event)
+    with sendlock:
+        if recorder is not None:
+            recorder.write(capture.OUTBOUND, event)
+        since = metrics.now()
+        ws.send(event)
+        metrics.observe(metrics.s_send, since)
 
 
 def on_error(_, error):
@@ -84,11 +152,79 @@ def on_message(ws, message):
     :param message: received message
     """
 
+    if recorder is not None:
+        recorder.write(capture.INBOUND, message)
+
+    # decode on the reader thread
+    events = batch.unbatch(sparkl_services.decode_msg(message))
+
+    # open, aggregate and close events change the instances that subsequent
+    # data events are handled against, so are always handled in order on the
+    # reader thread; the data events handed to the pool are admitted first,
+    # holding off the teardown of their instance until they are handled
+    for msg_dict in events:
+        if pool is None or msg_dict.get(sparkl_services.s_tag) in \
+                sparkl_services.ordered_events:
+            handle_event(ws, msg_dict)
+        else:
+            sparkl_services.admit(msg_dict)
+            pool.submit(ws, msg_dict)
+
+    # replies to a frame handled inline go back without waiting out the delay
+    if pool is None:
+        writer.flush()
+
+
+def handle_event(ws, msg_dict):
+    """
+    Handles a decoded event and sends back any reply, which is correlated
+    with the event by its ref
+    :param ws: websocket handle
+    :param msg_dict: decoded event
+    """
+
     # call transport neutral handling library
-    reply = sparkl_services.handle_msg(message, envpath)
+    reply = sparkl_services.handle_event(msg_dict, envpath)
 
-    logger.debug(str(reply))
+    logger.debug('%s', reply)
 
     # send reply back over ws transport
     if reply is not None:
-        sendevent(ws, json.dumps(reply))
+        writer.put(sparkl_services.encode_msg(reply))
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of worker threads, handling decoded events off the
+    websocket reader thread so that a slow script does not hold up
+    the events queued behind it.
+    """
+
+    def __init__(self, size, depth):
+        self.queue = queue.Queue(depth)
+        self.threads = []
+        for index in range(size):
+            thread = threading.Thread(
+                target=self.run, name='sparkl_ws_worker_' + str(index))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, ws, msg_dict):
+        """
+        Queues a decoded event for handling, blocking whilst the queue is full
+        :param ws: websocket handle
+        :param msg_dict: decoded event
+        """
+        self.queue.put((ws, msg_dict))
+
+    def run(self):
+        while True:
+            ws, msg_dict = self.queue.get()
+            try:
+                handle_event(ws, msg_dict)
+            except Exception as e:
+                logger.error(e)
+            finally:
+                sparkl_services.settle(msg_dict)
+                self.queue.task_done()
@@ -0,0 +1,91 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Smoke tests of the asyncio transport, running a container against the
+stand-in SPARKL server of sparkl_bench.
+"""
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import sparkl_services as ss
+from sparkl_bench import events, load
+from sparkl_bench.server import FakeServer
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class ContainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.envdir = os.path.join(self.workdir, 'env')
+        os.makedirs(self.envdir)
+        self.logfile = os.path.join(self.workdir, 'container.log')
+        self.server = FakeServer()
+
+        transport = os.environ.get('SPARKL_TRANSPORT')
+        os.environ['SPARKL_TRANSPORT'] = 'aio'
+        try:
+            self.process = load.launch(
+                self.server.port, self.workdir, self.envdir, self.logfile)
+        finally:
+            if transport is None:
+                del os.environ['SPARKL_TRANSPORT']
+            else:
+                os.environ['SPARKL_TRANSPORT'] = transport
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+        self.server.close()
+        shutil.rmtree(self.workdir, True)
+
+    def output(self):
+        src_ = open(self.logfile)
+        try:
+            return src_.read()
+        finally:
+            src_.close()
+
+    @unittest.skipIf(websockets is None, 'websockets is not installed')
+    def test_requests(self):
+        conn = self.server.accept(30)
+        try:
+            conn.send(json.dumps(events.openevent(
+                'I-aio', ss.s_type_scriptservice, 2, 2, 0, 8, 'python',
+                events.pythonscript(2))))
+
+            rand = random.Random(0)
+            eventids = ['E' + str(index) for index in range(8)]
+            for index, eventid in enumerate(eventids):
+                conn.send(json.dumps(events.dataevent(
+                    'I-aio', eventid, index % 2, 2, 8, rand)))
+
+            replies = [json.loads(conn.receive()) for _ in eventids]
+        finally:
+            conn.close()
+
+        self.assertEqual(
+            [ss.et_dataevent] * len(eventids),
+            [reply[ss.s_tag] for reply in replies])
+        self.assertEqual(
+            sorted(eventids),
+            sorted(reply[ss.s_attributes][ss.s_ref] for reply in replies))
+
+    @unittest.skipIf(websockets is not None, 'websockets is installed')
+    def test_websockets_missing(self):
+        self.assertNotEqual(0, self.process.wait(30))
+        self.assertIn('needs the websockets package', self.output())
+
+
+if __name__ == '__main__':
+    unittest.main()
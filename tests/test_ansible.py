@@ -0,0 +1,106 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the batching of concurrent ansible requests into playbook runs,
+against the stub ansible-playbook of sparkl_bench.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import sparkl_script
+from sparkl_bench import stubs
+
+s_batchkey = ('I-test', 'Op')
+s_ok = (True, sparkl_script.s_OK, {})
+s_failed = (False, sparkl_script.s_ERROR, {})
+
+
+class AnsibleBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = dict(
+            (name, getattr(sparkl_script, name))
+            for name in ('eclipse_command', 'ansible_command', 'ansible_sudo',
+                         'ansible_batch_window', 'ansible_batch_max',
+                         'runplaybook'))
+        stubs.install(self.dir)
+        sparkl_script.ansible_batch_window = 0.5
+
+        # the number of plays of each playbook run
+        self.runs = []
+        runplaybook = self.saved['runplaybook']
+
+        def counted(envpath, workdir_, plays):
+            self.runs.append(len(plays))
+            runplaybook(envpath, workdir_, plays)
+        sparkl_script.runplaybook = counted
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(sparkl_script, name, value)
+        shutil.rmtree(self.dir, True)
+
+    def request(self, index, tasks):
+        envpath = os.path.join(self.dir, 'env' + str(index))
+        os.makedirs(envpath)
+        return sparkl_script.execute_as_ansible(
+            'Op', envpath, None, {'n': str(index)}, {},
+            os.path.join(envpath, 'result.json'), play=(None, tasks),
+            batchkey=s_batchkey, workdir_=envpath)
+
+    def concurrently(self, tasks):
+        results = [None] * len(tasks)
+
+        def request(index):
+            results[index] = self.request(index, tasks[index])
+
+        threads = [threading.Thread(target=request, args=(index,))
+                   for index in range(len(tasks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced(self):
+        tasks = [{'debug': {'msg': 'ok'}}]
+        self.assertEqual([s_ok] * 4, self.concurrently([tasks] * 4))
+        self.assertEqual([4], self.runs)
+
+    def test_batch_max(self):
+        sparkl_script.ansible_batch_max = 2
+        tasks = [{'debug': {'msg': 'ok'}}]
+        self.assertEqual([s_ok] * 5, self.concurrently([tasks] * 5))
+        self.assertEqual([1, 2, 2], sorted(self.runs))
+
+    def test_failed_play(self):
+        ok = [{'debug': {'msg': 'ok'}}]
+        fail = [{'fail': {'msg': 'failed'}}]
+        self.assertEqual(
+            [s_ok, s_failed, s_ok], self.concurrently([ok, fail, ok]))
+        self.assertEqual([3], self.runs)
+
+    def test_isolatedplay(self):
+        play = {'hosts': 'all', 'vars': {}, 'tasks': [{'debug': {}}]}
+        isolated = sparkl_script.isolatedplay(play)
+
+        self.assertEqual([{'debug': {}}], play['tasks'])
+        self.assertEqual(1, len(isolated['tasks']))
+        self.assertEqual([{'debug': {}}], isolated['tasks'][0]['block'])
+        self.assertEqual(
+            'absent', isolated['tasks'][0]['rescue'][0]['file']['state'])
+
+    def test_unbatched(self):
+        sparkl_script.ansible_batch_window = 0
+        tasks = [{'debug': {'msg': 'ok'}}]
+        self.assertEqual([s_ok] * 2, self.concurrently([tasks] * 2))
+        self.assertEqual([], self.runs)
+
+
+if __name__ == '__main__':
+    unittest.main()
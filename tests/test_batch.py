@@ -0,0 +1,86 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the batch framing of events.
+"""
+
+import json
+import threading
+import unittest
+
+from sparkl_services import batch
+
+
+class NegotiatedTest(unittest.TestCase):
+
+    def test_not_negotiated(self):
+        self.assertIsNone(batch.negotiated('ws://host/sparkl?p=1'))
+        self.assertIsNone(batch.negotiated('ws://host/sparkl'))
+
+    def test_negotiated(self):
+        self.assertEqual(
+            (8, 1024, 5),
+            batch.negotiated(
+                'ws://host/sparkl?p=1&batch=true&batch_events=8'
+                '&batch_bytes=1024&batch_delay=5'))
+
+    def test_defaults(self):
+        self.assertEqual(
+            (batch.maxevents, batch.maxbytes, batch.maxdelay),
+            batch.negotiated('ws://host/sparkl?batch=true'))
+
+    def test_unbatch(self):
+        self.assertEqual([{'a': 1}], batch.unbatch({'a': 1}))
+        self.assertEqual(
+            [{'a': 1}, {'b': 2}], batch.unbatch([{'a': 1}, {'b': 2}]))
+
+
+class BatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = []
+        self.sent = threading.Event()
+
+    def send(self, frame):
+        self.frames.append(json.loads(frame))
+        self.sent.set()
+
+    def batcher(self, maxevents, maxbytes, maxdelay):
+        batcher = batch.Batcher(self.send, maxevents, maxbytes, maxdelay)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_flushed_on_events(self):
+        batcher = self.batcher(3, 65536, 60000)
+        for index in range(5):
+            batcher.add(json.dumps(index))
+
+        self.assertEqual([[0, 1, 2]], self.frames)
+        batcher.flush()
+        self.assertEqual([[0, 1, 2], [3, 4]], self.frames)
+
+    def test_flushed_on_bytes(self):
+        batcher = self.batcher(64, 10, 60000)
+        batcher.add(json.dumps('abc'))
+        batcher.add(json.dumps('defgh'))
+        batcher.add(json.dumps('i'))
+
+        self.assertEqual([['abc', 'defgh']], self.frames)
+
+    def test_flushed_on_delay(self):
+        batcher = self.batcher(64, 65536, 10)
+        batcher.add(json.dumps('a'))
+
+        self.assertTrue(self.sent.wait(5))
+        self.assertEqual([['a']], self.frames)
+
+    def test_flushed_on_close(self):
+        batcher = batch.Batcher(self.send, 64, 65536, 60000)
+        batcher.add(json.dumps('a'))
+        batcher.close()
+
+        self.assertEqual([['a']], self.frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
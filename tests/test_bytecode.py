@@ -0,0 +1,106 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the on-disk cache of compiled python scripts.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sparkl_script import bytecode
+from sparkl_script.modcache import sourcekey
+
+s_source = 'def double(n):\n    return n + n\n'
+
+
+class BytecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = bytecode.cachedir
+        bytecode.cachedir = tempfile.mkdtemp()
+        self.key = sourcekey(s_source)
+        self.path = bytecode.cachefile(self.key)
+
+        # counts compilations, shadowing the builtin
+        self.compiled = []
+        bytecode.compile = self.compile
+
+    def tearDown(self):
+        del bytecode.compile
+        shutil.rmtree(bytecode.cachedir, True)
+        bytecode.cachedir = self.cachedir
+
+    def compile(self, source, filename, mode):
+        self.compiled.append(filename)
+        return compile(source, filename, mode)
+
+    def load(self, name='sparkl_test'):
+        pymod = bytecode.loadmodule(name, s_source, self.key)
+        self.addCleanup(bytecode.unloadmodule, name)
+        return pymod
+
+    def write(self, content):
+        dst_ = open(self.path, 'wb')
+        dst_.write(content)
+        dst_.close()
+
+    def test_compiled_once(self):
+        self.assertEqual(4, self.load().double(2))
+        self.assertTrue(os.path.isfile(self.path))
+        self.assertEqual(4, self.load().double(2))
+        self.assertEqual(['<sparkl_test>'], self.compiled)
+
+    def test_other_filename_recompiled(self):
+        self.load()
+        self.load('sparkl_other')
+        self.assertEqual(['<sparkl_test>', '<sparkl_other>'], self.compiled)
+
+    def test_corrupt_file_recompiled(self):
+        self.load()
+        self.write(bytecode.MAGIC_NUMBER + b'\xff\x00garbage')
+
+        self.assertEqual(4, self.load().double(2))
+        self.assertEqual(2, len(self.compiled))
+
+        # and cached again
+        self.load()
+        self.assertEqual(2, len(self.compiled))
+
+    def test_wrong_magic_recompiled(self):
+        self.load()
+        src_ = open(self.path, 'rb')
+        content = src_.read()
+        src_.close()
+        self.write(b'\x00' * len(bytecode.MAGIC_NUMBER) +
+                   content[len(bytecode.MAGIC_NUMBER):])
+
+        self.assertEqual(4, self.load().double(2))
+        self.assertEqual(2, len(self.compiled))
+
+    def test_discard(self):
+        self.load()
+        bytecode.discard(self.key)
+        bytecode.discard(self.key)
+
+        self.assertFalse(os.path.exists(self.path))
+        self.load()
+        self.assertEqual(2, len(self.compiled))
+
+    def test_no_cache(self):
+        shutil.rmtree(bytecode.cachedir)
+        cachedir, bytecode.cachedir = bytecode.cachedir, ''
+        try:
+            self.load()
+            self.load()
+            bytecode.discard(self.key)
+        finally:
+            bytecode.cachedir = cachedir
+
+        self.assertEqual(2, len(self.compiled))
+        self.assertFalse(os.path.exists(cachedir))
+
+
+if __name__ == '__main__':
+    unittest.main()
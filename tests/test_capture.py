@@ -0,0 +1,98 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the capture file of frames exchanged over the message transport.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sparkl_services import capture
+
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'frames.cap')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+
+    def record(self, *frames):
+        writer = capture.CaptureWriter(self.path)
+        for direction, frame in frames:
+            writer.write(direction, frame)
+        writer.close()
+
+    def frames(self):
+        return [(direction, frame)
+                for direction, _timestamp, frame in capture.read(self.path)]
+
+    def test_round_trip(self):
+        self.record(
+            (capture.INBOUND, '{"tag": "open_event"}'),
+            (capture.OUTBOUND, u'{"data": "\\u00e9t\\u00e9"}'),
+            (capture.INBOUND, b'[]'))
+
+        self.assertEqual(
+            [(capture.INBOUND, '{"tag": "open_event"}'),
+             (capture.OUTBOUND, u'{"data": "\\u00e9t\\u00e9"}'),
+             (capture.INBOUND, '[]')],
+            self.frames())
+
+    def test_timestamps_in_order(self):
+        self.record((capture.INBOUND, 'a'), (capture.OUTBOUND, 'b'))
+        timestamps = [timestamp for _, timestamp, _ in capture.read(self.path)]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+    def test_empty(self):
+        self.record()
+        self.assertEqual([], self.frames())
+
+    def test_append(self):
+        self.record((capture.INBOUND, 'a'))
+        self.record((capture.OUTBOUND, 'b'), (capture.INBOUND, 'c'))
+
+        self.assertEqual(
+            [(capture.INBOUND, 'a'), (capture.OUTBOUND, 'b'),
+             (capture.INBOUND, 'c')],
+            self.frames())
+
+    def truncate(self, by):
+        size = os.path.getsize(self.path)
+        dst_ = open(self.path, 'r+b')
+        dst_.truncate(size - by)
+        dst_.close()
+
+    def test_truncated_frame(self):
+        self.record((capture.INBOUND, 'a'), (capture.OUTBOUND, 'bcd'))
+        self.truncate(1)
+        self.assertEqual([(capture.INBOUND, 'a')], self.frames())
+
+    def test_truncated_header(self):
+        self.record((capture.INBOUND, 'a'), (capture.OUTBOUND, 'bcd'))
+        self.truncate(3 + 2)
+        self.assertEqual([(capture.INBOUND, 'a')], self.frames())
+
+    def test_append_after_truncated(self):
+        self.record((capture.INBOUND, 'a'), (capture.OUTBOUND, 'bcd'))
+        self.truncate(1)
+        self.record((capture.INBOUND, 'e'))
+
+        self.assertEqual(
+            [(capture.INBOUND, 'a'), (capture.INBOUND, 'e')], self.frames())
+
+    def test_not_a_capture_file(self):
+        dst_ = open(self.path, 'wb')
+        dst_.write(b'something else')
+        dst_.close()
+
+        self.assertRaises(IOError, capture.CaptureWriter, self.path)
+        self.assertRaises(IOError, list, capture.read(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the lifecycle of service instances: teardown on close events,
+deferred whilst events are in flight, and eviction.
+"""
+
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+import sparkl_script
+import sparkl_services as ss
+from sparkl_bench import events
+
+
+class LifecycleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.envpath = tempfile.mkdtemp()
+        self.rand = random.Random(0)
+        self.instance_idle = ss.instance_idle
+        self.instance_max = ss.instance_max
+
+    def tearDown(self):
+        ss.instance_idle = self.instance_idle
+        ss.instance_max = self.instance_max
+        for instanceid in list(ss.metadata):
+            service = ss.metadata[instanceid]
+            service.inflight.clear()
+            service.closing = False
+            ss.teardown(instanceid)
+        shutil.rmtree(self.envpath, True)
+
+    def open(self, instanceid):
+        event = events.openevent(
+            instanceid, ss.s_type_scriptservice, 2, 2, 0, 8, 'python',
+            events.pythonscript(2))
+        ss.handle_event(event, self.envpath)
+        return ss.metadata[instanceid]
+
+    def close(self, instanceid, eventtag=ss.et_close):
+        ss.handle_event(
+            {ss.s_tag: eventtag, ss.s_attributes: {ss.s_ref: instanceid}},
+            self.envpath)
+
+    def data(self, instanceid, eventid):
+        return events.dataevent(instanceid, eventid, 0, 2, 8, self.rand)
+
+    def handle(self, msg_dict):
+        return ss.handle_event(msg_dict, self.envpath)[ss.s_tag]
+
+    def retained(self, service):
+        return [sparkl_script.planrefs(plan)[0] in sparkl_script.plan_refs
+                for plan in service.plans.values()]
+
+    def test_teardown(self):
+        service = self.open('I1')
+        self.close('I1')
+
+        self.assertNotIn('I1', ss.metadata)
+        self.assertEqual({}, service.plans)
+
+    def test_aggregate_event_tears_down(self):
+        self.open('I1')
+        self.close('I1', ss.et_aggevent)
+        self.assertNotIn('I1', ss.metadata)
+
+    def test_teardown_deferred_whilst_in_flight(self):
+        service = self.open('I1')
+        first = self.data('I1', 'E1')
+        second = self.data('I1', 'E2')
+        ss.admit(first)
+        ss.admit(second)
+
+        self.close('I1')
+        self.assertTrue(service.closing)
+        self.assertEqual([True, True], self.retained(service))
+
+        # admitted events are still handled, later ones are not
+        self.assertEqual(ss.et_dataevent, self.handle(first))
+        ss.settle(first)
+        self.assertIn('I1', ss.metadata)
+
+        late = self.data('I1', 'E3')
+        ss.admit(late)
+        self.assertEqual(ss.et_errorevent, self.handle(late))
+        ss.settle(late)
+        self.assertIn('I1', ss.metadata)
+
+        self.assertEqual(ss.et_dataevent, self.handle(second))
+        ss.settle(second)
+        self.assertNotIn('I1', ss.metadata)
+        self.assertEqual({}, service.plans)
+
+    def test_settled_concurrently(self):
+        service = self.open('I1')
+        msg_dicts = [self.data('I1', 'E' + str(index)) for index in range(64)]
+        for msg_dict in msg_dicts:
+            ss.admit(msg_dict)
+        self.close('I1')
+
+        released = []
+        release = ss.release
+        ss.release = released.append
+        try:
+            threads = [
+                threading.Thread(
+                    target=lambda part: [ss.settle(msg_dict)
+                                         for msg_dict in part],
+                    args=(msg_dicts[index::8],))
+                for index in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            ss.release = release
+
+        self.assertEqual([service], released)
+        self.assertNotIn('I1', ss.metadata)
+        release(service)
+
+    def test_data_event_after_teardown(self):
+        self.open('I1')
+        self.assertEqual(ss.et_dataevent, self.handle(self.data('I1', 'E1')))
+        self.close('I1')
+
+        reply = ss.handle_event(self.data('I1', 'E2'), self.envpath)
+        self.assertEqual(ss.et_errorevent, reply[ss.s_tag])
+        self.assertEqual('E2', reply[ss.s_attributes][ss.s_ref])
+
+    def test_reopen_whilst_closing(self):
+        service = self.open('I1')
+        event = self.data('I1', 'E1')
+        ss.admit(event)
+        self.close('I1')
+
+        self.assertIs(service, self.open('I1'))
+        self.assertFalse(service.closing)
+        ss.settle(event)
+
+        self.assertIn('I1', ss.metadata)
+        self.assertEqual(ss.et_dataevent, self.handle(self.data('I1', 'E2')))
+
+    def test_settle_without_admit(self):
+        self.open('I1')
+        ss.settle(self.data('I1', 'E1'))
+        ss.settle(self.data('I2', 'E1'))
+        self.assertIn('I1', ss.metadata)
+
+    def test_idle_eviction_skips_in_flight(self):
+        services = [self.open(instanceid) for instanceid in ('I1', 'I2', 'I3')]
+        for service in services:
+            service.lastused = 0
+        ss.instance_idle = 10
+        event = self.data('I2', 'E1')
+        ss.admit(event)
+
+        ss.evict(100)
+        self.assertEqual(['I2'], sorted(ss.metadata))
+
+        ss.settle(event)
+        ss.evict(100)
+        self.assertEqual([], sorted(ss.metadata))
+
+    def test_max_eviction_skips_in_flight(self):
+        ss.instance_max = 2
+        for lastused, instanceid in enumerate(('I1', 'I2')):
+            self.open(instanceid).lastused = lastused
+        event = self.data('I1', 'E1')
+        ss.admit(event)
+
+        # the least recently used is in flight, so the next one goes
+        self.open('I3')
+        self.assertEqual(['I1', 'I3'], sorted(ss.metadata))
+
+        ss.settle(event)
+        ss.metadata['I3'].lastused = 10
+        self.open('I4')
+        self.assertEqual(['I3', 'I4'], sorted(ss.metadata))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the resolution of log levels.
+"""
+
+import logging
+import os
+import unittest
+
+import sparkl_logging
+
+
+class GetLevelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.level = os.environ.pop(sparkl_logging.s_level_env, None)
+
+    def tearDown(self):
+        os.environ.pop(sparkl_logging.s_level_env, None)
+        if self.level is not None:
+            os.environ[sparkl_logging.s_level_env] = self.level
+
+    def test_default(self):
+        self.assertEqual(logging.DEBUG, sparkl_logging.getlevel())
+
+    def test_environment(self):
+        os.environ[sparkl_logging.s_level_env] = 'warning'
+        self.assertEqual(logging.WARNING, sparkl_logging.getlevel())
+
+    def test_given(self):
+        self.assertEqual(logging.INFO, sparkl_logging.getlevel('info'))
+        self.assertEqual(logging.ERROR, sparkl_logging.getlevel(40))
+
+    def test_unknown(self):
+        os.environ[sparkl_logging.s_level_env] = 'verbose'
+        self.assertEqual(logging.DEBUG, sparkl_logging.getlevel())
+        self.assertEqual(logging.DEBUG, sparkl_logging.getlevel('verbose'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the handling of open events, which give an instance's meta-data
+whole or in part.
+"""
+
+import copy
+import random
+import unittest
+
+import sparkl_script
+import sparkl_services as ss
+from sparkl_bench import events
+
+s_instance = 'I-test'
+
+
+class MetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.compiled = []
+        self.compile_props = ss.compile_props
+        self.compile_plans = ss.compile_plans
+        ss.compile_props = self.counted('props', self.compile_props)
+        ss.compile_plans = self.counted('plans', self.compile_plans)
+
+        self.event = events.openevent(
+            s_instance, ss.s_type_scriptservice, 3, 2, 1, 8, 'python',
+            events.pythonscript(3))
+        self.open(self.event)
+
+    def tearDown(self):
+        ss.compile_props = self.compile_props
+        ss.compile_plans = self.compile_plans
+        ss.teardown(s_instance)
+
+    def counted(self, name, compile_):
+        def compile_counted(service):
+            self.compiled.append(name)
+            compile_(service)
+        return compile_counted
+
+    def open(self, event):
+        del self.compiled[:]
+        ss.handle_metadata(s_instance, event[ss.s_content])
+        return ss.metadata[s_instance]
+
+    def section(self, event, tag):
+        for item in event[ss.s_content]:
+            if item[ss.s_tag] == tag:
+                return item
+
+    def partial(self, *tags):
+        event = copy.deepcopy(self.event)
+        event[ss.s_content] = [
+            item for item in event[ss.s_content] if item[ss.s_tag] in tags]
+        return event
+
+    def test_open(self):
+        service = ss.metadata[s_instance]
+        self.assertEqual(['props', 'plans'], self.compiled)
+        self.assertEqual(ss.s_type_scriptservice, service.type)
+        self.assertEqual(['Op0', 'Op1', 'Op2'], sorted(service.opnames))
+        self.assertEqual(['f0', 'f1'], sorted(service.fieldnames))
+        self.assertEqual(3, len(service.plans))
+
+    def test_unchanged(self):
+        plans = ss.metadata[s_instance].plans
+        service = self.open(copy.deepcopy(self.event))
+        self.assertEqual([], self.compiled)
+        self.assertIs(plans, service.plans)
+
+    def test_op_removed(self):
+        plans = dict(ss.metadata[s_instance].plans)
+        event = self.partial(ss.s_op_rrs)
+        self.section(event, ss.s_op_rrs)[ss.s_content].pop()
+
+        service = self.open(event)
+        self.assertEqual(['plans'], self.compiled)
+        self.assertEqual(['Op0', 'Op1'], sorted(service.opnames))
+        self.assertEqual(['f0', 'f1'], sorted(service.fieldnames))
+        for opid, plan in service.plans.items():
+            self.assertIs(plans[opid], plan)
+
+    def test_op_renamed(self):
+        plans = dict(ss.metadata[s_instance].plans)
+        event = self.partial(ss.s_op_rrs)
+        op = self.section(event, ss.s_op_rrs)[ss.s_content][1]
+        op[ss.s_attributes][ss.s_name] = 'Renamed'
+
+        service = self.open(event)
+        opid = op[ss.s_attributes][ss.s_id]
+        self.assertEqual(['Op0', 'Op2', 'Renamed'], sorted(service.opnames))
+        self.assertIsNot(plans[opid], service.plans[opid])
+        self.assertEqual('Renamed', service.plans[opid].opname)
+
+    def test_fields_only(self):
+        plans = ss.metadata[s_instance].plans
+        event = self.partial(ss.s_fieldstag)
+        self.section(event, ss.s_fieldstag)[ss.s_content].pop()
+
+        service = self.open(event)
+        self.assertEqual(['props'], self.compiled)
+        self.assertEqual(['f0'], sorted(service.fieldnames))
+        self.assertEqual(['Op0', 'Op1', 'Op2'], sorted(service.opnames))
+        self.assertIs(plans, service.plans)
+
+    def test_prop_changed(self):
+        event = self.partial(ss.s_service)
+        self.section(event, ss.s_service)[ss.s_content][0][ss.s_content] = \
+            ['changed']
+
+        service = self.open(event)
+        self.assertEqual(['props', 'plans'], self.compiled)
+        self.assertEqual('changed', service.propfields['bench__p0'])
+        self.assertEqual(3, len(service.plans))
+
+    def test_provision_changed(self):
+        event = self.partial(ss.s_service)
+        self.section(event, ss.s_service)[ss.s_attributes][ss.s_provision] = \
+            ss.s_type_containerservice
+
+        service = self.open(event)
+        self.assertEqual(['props', 'plans'], self.compiled)
+        self.assertEqual(ss.s_type_containerservice, service.type)
+        self.assertEqual({}, service.plans)
+
+    def test_provision_not_given(self):
+        event = self.partial(ss.s_service)
+        del self.section(event, ss.s_service)[ss.s_attributes][ss.s_provision]
+
+        service = self.open(event)
+        self.assertEqual([], self.compiled)
+        self.assertEqual(ss.s_type_scriptservice, service.type)
+
+    def scriptchanged(self):
+        event = self.partial(ss.s_service)
+        script = self.section(event, ss.s_service)[ss.s_content][1]
+        script[ss.s_content] = [script[ss.s_content][0] + '#\n']
+        return event
+
+    def retained(self, plans):
+        # the script state of each plan, the props being shared with the
+        # plans replacing them
+        return [sparkl_script.planrefs(plan)[0] in sparkl_script.plan_refs
+                for plan in plans]
+
+    def test_dropped_plans_released(self):
+        plans = list(ss.metadata[s_instance].plans.values())
+
+        self.open(self.scriptchanged())
+        self.assertEqual([False] * 3, self.retained(plans))
+
+    def test_dropped_plans_wait_for_events_in_flight(self):
+        plans = list(ss.metadata[s_instance].plans.values())
+        first = events.dataevent(s_instance, 'E0', 0, 2, 8, random.Random())
+        second = events.dataevent(s_instance, 'E1', 1, 2, 8, random.Random())
+        ss.admit(first)
+        ss.admit(second)
+
+        service = self.open(self.scriptchanged())
+        self.assertEqual(3, len(service.plans))
+        self.assertEqual([True] * 3, self.retained(plans))
+
+        # events admitted after the change do not hold the old plans
+        later = events.dataevent(s_instance, 'E2', 0, 2, 8, random.Random())
+        ss.admit(later)
+
+        ss.settle(first)
+        self.assertEqual([True] * 3, self.retained(plans))
+        ss.settle(second)
+        self.assertEqual([False] * 3, self.retained(plans))
+        self.assertEqual([], service.retired)
+        ss.settle(later)
+
+
+if __name__ == '__main__':
+    unittest.main()
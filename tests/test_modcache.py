@@ -0,0 +1,60 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the cache of loaded python script modules.
+"""
+
+import unittest
+
+from sparkl_script.modcache import ModuleCache, sourcekey
+
+
+class ModuleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.released = []
+        self.cache = ModuleCache(2, self.released.append)
+
+    def load(self, key):
+        return lambda: 'module ' + key
+
+    def test_sourcekey(self):
+        self.assertEqual(sourcekey('a = 1'), sourcekey('a = 1'))
+        self.assertNotEqual(sourcekey('a = 1'), sourcekey('a = 2'))
+
+    def test_hit_and_miss(self):
+        self.assertEqual('module a', self.cache.get('a', self.load('a')))
+        self.assertEqual(
+            'module a', self.cache.get('a', self.unexpected))
+
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['size'])
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get('a', self.load('a'))
+        self.cache.get('b', self.load('b'))
+        self.cache.get('a', self.load('a'))
+        self.cache.get('c', self.load('c'))
+
+        self.assertEqual(['b'], self.released)
+        self.assertEqual(['a', 'c'], sorted(self.cache.modules))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_discard(self):
+        self.cache.get('a', self.load('a'))
+        self.cache.discard('a')
+        self.cache.discard('a')
+
+        self.assertEqual(['a'], self.released)
+        self.assertEqual(0, self.cache.stats()['size'])
+        self.assertEqual('module a', self.cache.get('a', self.load('a')))
+        self.assertEqual(2, self.cache.stats()['misses'])
+
+    def unexpected(self):
+        self.fail('loaded on a hit')
+
+
+if __name__ == '__main__':
+    unittest.main()
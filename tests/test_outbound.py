@@ -0,0 +1,80 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the bounded queue of outbound events.
+"""
+
+import threading
+import unittest
+
+from sparkl_services.outbound import OutboundQueue
+
+
+class OutboundQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.flushes = []
+
+    def test_sent_in_order(self):
+        writer = OutboundQueue(self.sent.append, 4)
+        for index in range(10):
+            self.assertTrue(writer.put(str(index)))
+        writer.close()
+
+        self.assertEqual([str(index) for index in range(10)], self.sent)
+
+    def test_flush_after_queued(self):
+        writer = OutboundQueue(
+            self.sent.append, 4, lambda: self.flushes.append(len(self.sent)))
+        writer.put('a')
+        writer.put('b')
+        writer.flush()
+        writer.close()
+
+        self.assertEqual([2], self.flushes)
+
+    def test_flush_without_flush_function(self):
+        writer = OutboundQueue(self.sent.append, 4)
+        writer.flush()
+        writer.put('a')
+        writer.close()
+
+        self.assertEqual(['a'], self.sent)
+
+    def test_dropped_when_full(self):
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def send(event):
+            blocked.set()
+            release.wait()
+            self.sent.append(event)
+
+        writer = OutboundQueue(send, 1)
+        writer.put('a')
+        self.assertTrue(blocked.wait(5))
+        self.assertTrue(writer.put('b', 0.01))
+        self.assertFalse(writer.put('c', 0.01))
+        self.assertEqual(1, writer.dropped)
+
+        release.set()
+        writer.close()
+        self.assertEqual(['a', 'b'], self.sent)
+
+    def test_send_errors_logged(self):
+        def send(event):
+            if event == 'bad':
+                raise ValueError(event)
+            self.sent.append(event)
+
+        writer = OutboundQueue(send, 4)
+        writer.put('bad')
+        writer.put('good')
+        writer.close()
+
+        self.assertEqual(['good'], self.sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
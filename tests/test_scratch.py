@@ -0,0 +1,124 @@
+"""
+Copyright 2016 Sparkl Limited. All Rights Reserved.
+Authors: Andrew Farrell <ahfarrell@sparkl.com>
+Tests of the pool of scratch environments for script execution.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sparkl_script.scratch import ScratchPool, propskey
+
+
+class ScratchPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pool = ScratchPool(self.root, 'envs', 'result.json')
+        self.props = [('data.txt', 'data')]
+        self.key = propskey(self.props)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, True)
+
+    def read(self, env, name):
+        src_ = open(os.path.join(env.subdir, name))
+        try:
+            return src_.read()
+        finally:
+            src_.close()
+
+    def test_propskey(self):
+        self.assertEqual(self.key, propskey([('data.txt', 'data')]))
+        self.assertNotEqual(self.key, propskey([('data.txt', 'other')]))
+
+    def append(self, env, name, text):
+        dst_ = open(os.path.join(env.subdir, name), 'a')
+        dst_.write(text)
+        dst_.close()
+
+    def test_acquire_copies_props(self):
+        env = self.pool.acquire(self.props, self.key)
+        self.assertEqual('data', self.read(env, 'data.txt'))
+        self.assertFalse(
+            os.path.islink(os.path.join(env.subdir, 'data.txt')))
+
+    def test_release_cleans_and_reuses(self):
+        env = self.pool.acquire(self.props, self.key)
+        open(env.resultfile, 'w').close()
+        open(os.path.join(env.subdir, 'artifact'), 'w').close()
+        self.pool.release(env)
+
+        self.assertEqual(['envs'], os.listdir(env.path))
+        self.assertEqual(['data.txt'], os.listdir(env.subdir))
+        self.assertIs(env, self.pool.acquire(self.props, self.key))
+        self.assertEqual(1, self.pool.count)
+
+    def test_concurrent_acquires_get_own_envs(self):
+        env1 = self.pool.acquire(self.props, self.key)
+        env2 = self.pool.acquire(self.props, self.key)
+        self.assertNotEqual(env1.path, env2.path)
+
+    def test_changed_props_relinked(self):
+        env = self.pool.acquire(self.props, self.key)
+        self.pool.release(env)
+
+        props = [('other.txt', 'other')]
+        env = self.pool.acquire(props, propskey(props))
+        self.assertEqual(['other.txt'], os.listdir(env.subdir))
+        self.assertEqual('other', self.read(env, 'other.txt'))
+
+    def test_replaced_prop_restored(self):
+        env = self.pool.acquire(self.props, self.key)
+        link = os.path.join(env.subdir, 'data.txt')
+        os.unlink(link)
+        dst_ = open(link, 'w')
+        dst_.write('overwritten')
+        dst_.close()
+        self.pool.release(env)
+
+        env = self.pool.acquire(self.props, self.key)
+        self.assertEqual('data', self.read(env, 'data.txt'))
+
+    def test_changed_prop_restored(self):
+        env = self.pool.acquire(self.props, self.key)
+        other = self.pool.acquire(self.props, self.key)
+        self.append(env, 'data.txt', '+SCRIBBLE')
+        self.assertEqual('data', self.read(other, 'data.txt'))
+        self.pool.release(env)
+        self.pool.release(other)
+
+        env = self.pool.acquire(self.props, self.key)
+        other = self.pool.acquire(self.props, self.key)
+        self.assertEqual('data', self.read(env, 'data.txt'))
+        self.assertEqual('data', self.read(other, 'data.txt'))
+
+    def test_removed_prop_restored(self):
+        env = self.pool.acquire(self.props, self.key)
+        os.unlink(os.path.join(env.subdir, 'data.txt'))
+        self.pool.release(env)
+
+        env = self.pool.acquire(self.props, self.key)
+        self.assertEqual('data', self.read(env, 'data.txt'))
+
+    def test_forget(self):
+        idle = self.pool.acquire(self.props, self.key)
+        busy = self.pool.acquire(self.props, self.key)
+        self.pool.release(idle)
+
+        self.pool.forget(self.key)
+        self.assertEqual([], os.listdir(self.pool.propspath))
+        self.assertEqual([], os.listdir(idle.subdir))
+
+        # the env in use at the time is relinked on its next acquire
+        self.pool.release(busy)
+        env = self.pool.acquire(self.props, self.key)
+        self.assertEqual('data', self.read(env, 'data.txt'))
+        env = self.pool.acquire(self.props, self.key)
+        self.assertEqual('data', self.read(env, 'data.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()